@@ -1,58 +1,194 @@
 import unittest
-from utils import read_file_to_list
+from concurrent.futures import ProcessPoolExecutor
+from intcode import IntcodeVM, load_program
+from intcode_numpy import LockstepVM, np
 
 
 def find_output_19690720(starting_intcode=None):
-    noun = 0
+    return find_noun_and_verb(starting_intcode, 19690720)
 
-    while noun < 100:
-        verb = 0
-        while verb < 100:
-            intcode = starting_intcode.copy()
-            intcode[1] = noun
-            intcode[2] = verb
-            result = process_intcode(intcode)[0]
 
-            if result == 19690720:
+def find_noun_and_verb(starting_intcode, target, nouns=range(100), verbs=range(100)):
+    vm = IntcodeVM(starting_intcode)
+    result = _search_nouns(vm, target, nouns, verbs)
+
+    if result is None:
+        raise ValueError(f"output {target} not with input")
+
+    return result
+
+
+def find_noun_and_verb_parallel(
+    starting_intcode, target, nouns=range(100), verbs=range(100), workers=None
+):
+    # one task per noun, collected in noun order so the winner is the same
+    # pair the serial search would return
+    with ProcessPoolExecutor(
+        workers, initializer=_start_worker, initargs=(starting_intcode,)
+    ) as executor:
+        futures = [
+            executor.submit(_search_worker_nouns, target, [noun], verbs)
+            for noun in nouns
+        ]
+
+        for future in futures:
+            result = future.result()
+
+            if result is not None:
+                for pending in futures:
+                    pending.cancel()
+
+                return result
+
+    raise ValueError(f"output {target} not with input")
+
+
+def find_noun_and_verb_lockstep(
+    starting_intcode, target, nouns=range(100), verbs=range(100)
+):
+    # every noun/verb pair as one lane of a LockstepVM; pairs whose lane
+    # stopped on an error are rerun on IntcodeVM, so the winner (or the
+    # error) is the one the serial search would give
+    pairs = [(noun, verb) for noun in nouns for verb in verbs]
+    vm = LockstepVM(starting_intcode, len(pairs))
+    vm.poke(1, [noun for noun, _ in pairs])
+    vm.poke(2, [verb for _, verb in pairs])
+    vm.run()
+
+    for lane, (result, (noun, verb)) in enumerate(zip(vm.peek(0), pairs)):
+        if lane in vm.errors:
+            if _search_nouns(IntcodeVM(starting_intcode), target, [noun], [verb]):
                 return [noun, verb]
+        elif result == target:
+            return [noun, verb]
 
-            verb += 1
+    raise ValueError(f"output {target} not with input")
 
-        noun += 1
 
-    raise ValueError("output 19690720 not with input")
+def find_noun_and_verb_symbolic(
+    starting_intcode, target, nouns=range(100), verbs=range(100)
+):
+    # solve output = constant + a * noun + b * verb directly, falling back
+    # to brute force when the program does not reduce to that form
+    affine = _affine_output(starting_intcode)
 
+    if affine is not None:
+        result = _solve_affine(affine, target, nouns, verbs)
 
-def process_intcode(intcode):
-    intcode = intcode.copy()  # shadow intcode to stop mutation outside of the block
+        if result is None:
+            raise ValueError(f"output {target} not with input")
+
+        vm = IntcodeVM(starting_intcode)
+        vm.poke(1, result[0])
+        vm.poke(2, result[1])
+
+        if vm.run()[0] == target:
+            return result
+
+    return find_noun_and_verb(starting_intcode, target, nouns, verbs)
+
+
+def _affine_output(starting_intcode):
+    # cells hold (constant, noun coefficient, verb coefficient) or None when
+    # the value depends on a noun/verb-addressed read we cannot follow
+    memory = [(value, 0, 0) for value in starting_intcode]
+    memory[1] = (0, 1, 0)
+    memory[2] = (0, 0, 1)
     pointer = 0
 
-    while pointer < len(intcode):
-        opcode = {1: "ADDITION", 2: "MULTIPLICATION", 99: "HALT",}.get(intcode[pointer])
+    try:
+        while pointer < len(memory):
+            opcode = _concrete(memory[pointer])
+
+            if opcode == 99:
+                break
+            elif opcode not in (1, 2):
+                return None
+
+            first, second, target = (
+                _concrete(memory[pointer + offset]) for offset in (1, 2, 3)
+            )
+            if target is None:
+                return None
+
+            a = None if first is None else memory[first]
+            b = None if second is None else memory[second]
+
+            if a is None or b is None:
+                memory[target] = None
+            elif opcode == 1:
+                memory[target] = (a[0] + b[0], a[1] + b[1], a[2] + b[2])
+            elif _concrete(a) is not None:
+                memory[target] = (a[0] * b[0], a[0] * b[1], a[0] * b[2])
+            elif _concrete(b) is not None:
+                memory[target] = (b[0] * a[0], b[0] * a[1], b[0] * a[2])
+            else:
+                return None
+
+            pointer += 4
+    except IndexError:
+        return None
+
+    return memory[0]
+
+
+def _concrete(value):
+    if value is None or value[1] or value[2]:
+        return None
+
+    return value[0]
+
+
+def _solve_affine(affine, target, nouns, verbs):
+    constant, noun_coefficient, verb_coefficient = affine
+
+    for noun in nouns:
+        remainder = target - constant - noun_coefficient * noun
+
+        if verb_coefficient == 0:
+            if remainder == 0:
+                for verb in verbs:
+                    return [noun, verb]
+            continue
 
-        if opcode == "HALT":
-            break
-        elif opcode == "ADDITION":
-            augend = intcode[pointer + 1]
-            addend = intcode[pointer + 2]
-            target = intcode[pointer + 3]
+        verb, leftover = divmod(remainder, verb_coefficient)
+        if leftover == 0 and verb in verbs:
+            return [noun, verb]
 
-            intcode[target] = intcode[augend] + intcode[addend]
-        elif opcode == "MULTIPLICATION":
-            multiplier = intcode[pointer + 1]
-            multiplicand = intcode[pointer + 2]
-            target = intcode[pointer + 3]
+    return None
 
-            intcode[target] = intcode[multiplier] * intcode[multiplicand]
-        else:
-            raise ValueError("opcode should be 1, 2 or 99")
-        pointer += 4
 
-    return intcode
+def _search_nouns(vm, target, nouns, verbs):
+    for noun in nouns:
+        for verb in verbs:
+            vm.reset()
+            vm.poke(1, noun)
+            vm.poke(2, verb)
+
+            if vm.run()[0] == target:
+                return [noun, verb]
+
+    return None
+
+
+_worker_vm = None
+
+
+def _start_worker(starting_intcode):
+    global _worker_vm
+    _worker_vm = IntcodeVM(starting_intcode)
+
+
+def _search_worker_nouns(target, nouns, verbs):
+    return _search_nouns(_worker_vm, target, nouns, verbs)
+
+
+def process_intcode(intcode):
+    return IntcodeVM(intcode).run()
 
 
 if __name__ == "__main__":
-    intcode = [int(x) for x in read_file_to_list("input/02.txt")[0].split(",")]
+    intcode = load_program("input/02.txt")
 
     # replace two positions with hardcoded data (via instructions)
     intcode[1] = 12
@@ -61,8 +197,8 @@ if __name__ == "__main__":
     print(process_intcode(intcode))
     print(f"the value at position 0 after the program halts is: {intcode[0]}")
 
-    intcode = [int(x) for x in read_file_to_list("input/02.txt")[0].split(",")]
-    output_19690720 = find_output_19690720(intcode)
+    intcode = load_program("input/02.txt")
+    output_19690720 = find_noun_and_verb_symbolic(intcode, 19690720)
     print(f"100 * noun + verb = {100 * output_19690720[0] + output_19690720[1]}")
 
 
@@ -94,3 +230,79 @@ class Test(unittest.TestCase):
         result = process_intcode([1, 1, 1, 4, 99, 5, 6, 0, 99])
 
         self.assertEqual([30, 1, 1, 4, 2, 5, 6, 0, 99], result)
+
+    def test_find_noun_and_verb(self):
+        # position 0 ends up as intcode[noun] + intcode[verb]
+        intcode = [1, 0, 0, 0, 99, 10, 20, 30]
+
+        result = find_noun_and_verb(intcode, 40, range(5, 8), range(5, 8))
+
+        self.assertEqual([5, 7], result)
+
+    def test_find_noun_and_verb_raises_when_not_found(self):
+        with self.assertRaises(ValueError):
+            find_noun_and_verb(
+                [1, 0, 0, 0, 99, 10, 20, 30], 1000, range(5, 8), range(5, 8)
+            )
+
+    def test_parallel_search_matches_serial_winner(self):
+        intcode = [1, 0, 0, 0, 99, 10, 20, 30]
+        nouns = verbs = range(5, 8)
+
+        for target in (20, 40, 50, 60):
+            self.assertEqual(
+                find_noun_and_verb(intcode, target, nouns, verbs),
+                find_noun_and_verb_parallel(intcode, target, nouns, verbs, workers=2),
+            )
+
+    def test_parallel_search_raises_when_not_found(self):
+        with self.assertRaises(ValueError):
+            find_noun_and_verb_parallel(
+                [1, 0, 0, 0, 99, 10, 20, 30], 1000, range(5, 8), range(5, 8), workers=2
+            )
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_lockstep_search_matches_serial_winner(self):
+        intcode = [1, 0, 0, 0, 99, 10, 20, 30]
+        nouns = verbs = range(5, 8)
+
+        for target in (20, 40, 50, 60):
+            self.assertEqual(
+                find_noun_and_verb(intcode, target, nouns, verbs),
+                find_noun_and_verb_lockstep(intcode, target, nouns, verbs),
+            )
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_lockstep_search_raises_like_serial_search(self):
+        # noun 9 is past the end of the program
+        with self.assertRaises(IndexError):
+            find_noun_and_verb_lockstep(
+                [1, 0, 0, 0, 99, 10, 20, 30], 1000, range(5, 10), range(5, 8)
+            )
+
+    def test_affine_output_is_found_symbolically(self):
+        # (noun + verb) * 7, reading noun and verb as addresses first
+        intcode = [1, 0, 0, 3, 1, 1, 2, 3, 2, 3, 13, 0, 99, 7] + [0] * 86
+
+        self.assertEqual((0, 7, 7), _affine_output(intcode))
+
+    def test_non_affine_output_is_rejected(self):
+        intcode = [1, 0, 0, 3, 2, 1, 2, 0, 99] + [0] * 91
+
+        self.assertIsNone(_affine_output(intcode))
+
+    def test_symbolic_search_matches_brute_force(self):
+        affine = [1, 0, 0, 3, 1, 1, 2, 3, 2, 3, 13, 0, 99, 7] + [0] * 86
+        non_affine = [1, 0, 0, 3, 2, 1, 2, 0, 99] + [0] * 91
+
+        for intcode, target in ((affine, 70), (affine, 7 * 150), (non_affine, 36)):
+            self.assertEqual(
+                find_noun_and_verb(intcode, target),
+                find_noun_and_verb_symbolic(intcode, target),
+            )
+
+    def test_symbolic_search_raises_when_not_found(self):
+        intcode = [1, 0, 0, 3, 1, 1, 2, 3, 2, 3, 13, 0, 99, 7] + [0] * 86
+
+        with self.assertRaises(ValueError):
+            find_noun_and_verb_symbolic(intcode, 71)
@@ -1,9 +1,33 @@
+import heapq
 import unittest
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ProcessPoolExecutor
 from functools import reduce
-from itertools import accumulate
+from itertools import accumulate, combinations
 from utils import read_file_to_list
 
+try:
+    import numpy as np
+except ImportError:  # optional, only the wire_array functions need it
+    np = None
+
+# points packed into one int, x in the high bits: x and y must fit in 32
+# bits, and a step along x or y adds a constant, so a straight run of cells
+# is a range of keys
+X_STEP = 1 << 32
+Y_STEP = 1
+
+def pack(x, y):
+    return x * X_STEP + y
+
+def unpack(key):
+    y = ((key + (1 << 31)) & 0xFFFFFFFF) - (1 << 31)
+
+    return (key - y) >> 32, y
+
 class Point:
+    __slots__ = ("x", "y")
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
@@ -12,13 +36,21 @@ class Point:
         return Point(x=self.x + x, y=self.y + y)
 
     def __eq__(self, other):
-        if isinstance(other, self.__class__):
+        if other.__class__ is self.__class__ or isinstance(other, self.__class__):
             return self.x == other.x and self.y == other.y
 
         return False
 
     def __hash__(self):
-        return hash((self.x, self.y))
+        return self.x * X_STEP + self.y
+
+    @property
+    def key(self):
+        return pack(self.x, self.y)
+
+    @classmethod
+    def from_key(cls, key):
+        return cls(*unpack(key))
 
     def __repr__(self):
         return f"({self.x}, {self.y})"
@@ -60,6 +92,8 @@ class Move:
         except ValueError:
             raise ValueError(f"Movement amount must be an integer: {amount} provided")
 
+DIRECTIONS = {"U": (0, 1), "D": (0, -1), "L": (-1, 0), "R": (1, 0)}
+
 def find_intersections(points_one, points_two):
     intersections = set(points_one) & set(points_two)
     intersections.discard(Point(0,0))
@@ -95,22 +129,309 @@ def move_list_of_movements(movements):
 
     return points
 
+def trace_wire(movements):
+    # the points of move_list_of_movements, along with the step each point
+    # was first reached at, recorded as the path is built
+    current_point = Point(0,0)
+    points = [current_point]
+    steps = {current_point: 0}
+
+    for movement in movements:
+        next_point = move_to_next_point(current_point, Move(movement))
+        for point in next_point[1:]:
+            steps.setdefault(point, len(points))
+            points.append(point)
+        current_point = next_point[-1]
+
+    return points, steps
+
+def fewest_combined_steps(steps_one, steps_two):
+    # fewest steps both wires take to reach a crossing, from trace_wire steps
+    crossings = steps_one.keys() & steps_two.keys()
+    crossings.discard(Point(0,0))
+
+    return min(steps_one[point] + steps_two[point] for point in crossings)
+
+def move_list_of_keys(movements):
+    # move_list_of_movements as packed keys, each segment added as one range
+    keys = [0]
+    key = 0
+
+    for movement in movements:
+        move = Move(movement)
+        distance = abs(move.amount)
+        dx, dy = DIRECTIONS[move.direction]
+        step = dx * X_STEP + dy * Y_STEP
+        keys.extend(range(key + step, key + step * (distance + 1), step))
+        key += step * distance
+
+    return keys
+
+def first_visit_steps(keys):
+    # key -> step it was first reached at; walking backwards lets the first
+    # visit overwrite later ones
+    return dict(zip(reversed(keys), range(len(keys) - 1, -1, -1)))
+
+def closest_and_fewest_keys(keys_one, keys_two):
+    # closest_and_fewest for wires given as move_list_of_keys
+    steps_one = first_visit_steps(keys_one)
+    steps_two = first_visit_steps(keys_two)
+    crossings = steps_one.keys() & steps_two.keys()
+    crossings.discard(0)
+
+    if not crossings:
+        raise ValueError("the wires do not cross")
+
+    closest = min(sum(map(abs, unpack(key))) for key in crossings)
+    fewest = min(steps_one[key] + steps_two[key] for key in crossings)
+
+    return closest, fewest
+
+def wire_array(movements):
+    # move_list_of_keys as an int64 array: the key step of each segment is
+    # repeated once per cell and summed up, so no cell is built in Python
+    moves = [Move(movement) for movement in movements]
+    distances = np.array([abs(move.amount) for move in moves], dtype=np.int64)
+    steps = np.array([DIRECTIONS[move.direction][0] * X_STEP + DIRECTIONS[move.direction][1] * Y_STEP for move in moves], dtype=np.int64)
+
+    keys = np.zeros(int(distances.sum()) + 1, dtype=np.int64)
+    np.cumsum(np.repeat(steps, distances), out=keys[1:])
+
+    return keys
+
+def closest_and_fewest_array(keys_one, keys_two):
+    # closest_and_fewest for wire_array wires; np.unique gives each key's
+    # first index, which is the step it was first reached at
+    unique_one, steps_one = np.unique(keys_one, return_index=True)
+    unique_two, steps_two = np.unique(keys_two, return_index=True)
+    crossings, index_one, index_two = np.intersect1d(unique_one, unique_two, assume_unique=True, return_indices=True)
+
+    away = crossings != 0
+    if not away.any():
+        raise ValueError("the wires do not cross")
+
+    crossings = crossings[away]
+    y = ((crossings + (1 << 31)) & 0xFFFFFFFF) - (1 << 31)
+    x = (crossings - y) >> 32
+    closest = int((np.abs(x) + np.abs(y)).min())
+    fewest = int((steps_one[index_one[away]] + steps_two[index_two[away]]).min())
+
+    return closest, fewest
+
 def count_steps(wire, intersection_index):
-    return len(wire[:intersection_index])
+    # the length of wire[:intersection_index] without copying the slice
+    return len(range(len(wire))[:intersection_index])
 
-if __name__ == "__main__":
-    wire_paths = list(map(lambda wire_path: wire_path.split(","), read_file_to_list("input/03.txt")))
-    wire_points = []
+def wire_segments(movements):
+    # the wire as (x1, y1, x2, y2, steps) segments in the order they are
+    # travelled, steps being how many it took to reach (x1, y1)
+    segments = []
+    x, y, steps = 0, 0, 0
+
+    for movement in movements:
+        move = Move(movement)
+        distance = abs(move.amount)
+        dx, dy = DIRECTIONS[move.direction]
+        segments.append((x, y, x + dx * distance, y + dy * distance, steps))
+        x, y, steps = x + dx * distance, y + dy * distance, steps + distance
+
+    return segments
+
+def _steps_to(segment, x, y):
+    return segment[4] + abs(x - segment[0]) + abs(y - segment[1])
+
+def _split(segments):
+    # vertical segments, and horizontal ones (including any of length zero)
+    vertical = [segment for segment in segments if segment[0] == segment[2] and segment[1] != segment[3]]
+    horizontal = [segment for segment in segments if segment[1] == segment[3]]
+
+    return vertical, horizontal
+
+def _crossings(vertical, horizontal):
+    # sweep along x keeping the y of every horizontal segment under the line
+    # sorted, so each vertical segment only visits the ones it crosses
+    events = []
+    for index, segment in enumerate(horizontal):
+        events.append((min(segment[0], segment[2]), 0, index))
+        events.append((max(segment[0], segment[2]), 2, index))
+    for index, segment in enumerate(vertical):
+        events.append((segment[0], 1, index))
+    events.sort()
+
+    active = []
+    for x, kind, index in events:
+        if kind == 0:
+            insort(active, (horizontal[index][1], index))
+        elif kind == 2:
+            del active[bisect_left(active, (horizontal[index][1], index))]
+        else:
+            segment = vertical[index]
+            low, high = sorted((segment[1], segment[3]))
+            start = bisect_left(active, (low, -1))
+            end = bisect_right(active, (high, len(horizontal)))
+
+            for y, other in active[start:end]:
+                yield x, y, segment, horizontal[other]
+
+def _overlaps(intervals_one, intervals_two):
+    # pairs of overlapping (low, high, segment) intervals, one from each list
+    events = sorted([(interval, 0) for interval in intervals_one] + [(interval, 1) for interval in intervals_two], key=lambda event: event[0][:2])
+    active = ([], [])
+
+    for index, ((low, high, segment), wire) in enumerate(events):
+        others = active[1 - wire]
+        while others and others[0][0] < low:
+            heapq.heappop(others)
+
+        for _, _, other in others:
+            yield (low, min(high, other[1]), segment, other[2]) if wire == 0 else (low, min(high, other[1]), other[2], segment)
+
+        heapq.heappush(active[wire], (high, index, (low, high, segment)))
+
+def _collinear(segments_one, segments_two, axis):
+    # every shared cell of segments lying along the same line
+    lines = {}
+    for wire, segments in enumerate((segments_one, segments_two)):
+        for segment in segments:
+            line = lines.setdefault(segment[1 - axis], ([], []))
+            low, high = sorted((segment[axis], segment[axis + 2]))
+            line[wire].append((low, high, segment))
+
+    for fixed, (intervals_one, intervals_two) in lines.items():
+        for low, high, segment_one, segment_two in _overlaps(intervals_one, intervals_two):
+            for moving in range(low, high + 1):
+                yield (moving, fixed, segment_one, segment_two) if axis == 0 else (fixed, moving, segment_one, segment_two)
+
+def segment_intersections(segments_one, segments_two):
+    # (x, y, steps along wire one, steps along wire two) for every crossing of
+    # two segment lists, skipping the origin. A cell the wires share more
+    # than once appears once per pair of segments through it.
+    vertical_one, horizontal_one = _split(segments_one)
+    vertical_two, horizontal_two = _split(segments_two)
+
+    found = [
+        ((x, y, one, two) for x, y, one, two in _crossings(vertical_one, horizontal_two)),
+        ((x, y, one, two) for x, y, two, one in _crossings(vertical_two, horizontal_one)),
+        _collinear(horizontal_one, horizontal_two, 0),
+        _collinear(vertical_one, vertical_two, 1),
+    ]
+
+    for crossings in found:
+        for x, y, one, two in crossings:
+            if x or y:
+                yield x, y, _steps_to(one, x, y), _steps_to(two, x, y)
+
+def closest_and_fewest(movements_one, movements_two):
+    # the Manhattan distance of the closest crossing and the fewest combined
+    # steps to a crossing, without expanding the wires cell by cell
+    result = _closest_and_fewest(wire_segments(movements_one), wire_segments(movements_two))
+
+    if result is None:
+        raise ValueError("the wires do not cross")
+
+    return result
+
+def _closest_and_fewest(segments_one, segments_two):
+    closest = fewest = None
+
+    for x, y, steps_one, steps_two in segment_intersections(segments_one, segments_two):
+        distance = abs(x) + abs(y)
+        closest = distance if closest is None else min(closest, distance)
+        fewest = steps_one + steps_two if fewest is None else min(fewest, steps_one + steps_two)
+
+    return None if closest is None else (closest, fewest)
+
+def grid_buckets(wire_segment_lists, size):
+    # (bucket x, bucket y) -> {wire: indexes of its segments in the bucket}
+    # for a grid of size by size buckets; two segments can only cross if
+    # they share a bucket
+    buckets = {}
+
+    for wire, segments in enumerate(wire_segment_lists):
+        for index, (x1, y1, x2, y2, _) in enumerate(segments):
+            for bucket_x in range(min(x1, x2) // size, max(x1, x2) // size + 1):
+                for bucket_y in range(min(y1, y2) // size, max(y1, y2) // size + 1):
+                    buckets.setdefault((bucket_x, bucket_y), {}).setdefault(wire, []).append(index)
+
+    return buckets
+
+def _candidate_pairs(wire_segment_lists, bucket_size):
+    # (wire, other wire) -> the segment indexes of each that share a bucket
+    if bucket_size is None:
+        # about the average segment length, so a segment covers a few buckets
+        lengths = [abs(x2 - x1) + abs(y2 - y1) for segments in wire_segment_lists for x1, y1, x2, y2, _ in segments]
+        bucket_size = max(1, sum(lengths) // max(1, len(lengths)))
+
+    pairs = {}
+    for wires in grid_buckets(wire_segment_lists, bucket_size).values():
+        for one, two in combinations(sorted(wires), 2):
+            indexes_one, indexes_two = pairs.setdefault((one, two), (set(), set()))
+            indexes_one.update(wires[one])
+            indexes_two.update(wires[two])
+
+    return pairs
+
+def _pair_result(wire_segment_lists, one, two, indexes_one, indexes_two):
+    segments_one = [wire_segment_lists[one][index] for index in sorted(indexes_one)]
+    segments_two = [wire_segment_lists[two][index] for index in sorted(indexes_two)]
+
+    return _closest_and_fewest(segments_one, segments_two)
+
+def pairwise_closest_and_fewest(wires, bucket_size=None):
+    # {(wire, other wire): (closest, fewest)} for every pair of wires that
+    # cross, comparing only the segments that share a grid bucket
+    wire_segment_lists = [wire_segments(movements) for movements in wires]
+    results = {}
+
+    for (one, two), (indexes_one, indexes_two) in _candidate_pairs(wire_segment_lists, bucket_size).items():
+        result = _pair_result(wire_segment_lists, one, two, indexes_one, indexes_two)
+        if result is not None:
+            results[one, two] = result
+
+    return results
+
+def pairwise_closest_and_fewest_parallel(wires, bucket_size=None, workers=None, chunk_size=64):
+    # pairwise_closest_and_fewest with the candidate pairs checked in chunks
+    # by worker processes, each given every wire's segments once
+    wire_segment_lists = [wire_segments(movements) for movements in wires]
+    candidates = list(_candidate_pairs(wire_segment_lists, bucket_size).items())
+    results = {}
+
+    with ProcessPoolExecutor(workers, initializer=_start_worker, initargs=(wire_segment_lists,)) as executor:
+        chunks = [candidates[start:start + chunk_size] for start in range(0, len(candidates), chunk_size)]
+
+        for chunk_results in executor.map(_check_pairs, chunks):
+            results.update(chunk_results)
+
+    return results
 
-    for wire_path in wire_paths:
-        wire_points.append(move_list_of_movements(wire_path))
+_worker_segments = None
 
-    intersections = find_intersections(wire_points[0], wire_points[1])
-    steps = [[count_steps(path, path.index(intersection)) for intersection in intersections] for path in wire_points]
-    fewest_steps = min(first_wire + second_wire for (first_wire, second_wire) in zip(steps[0], steps[1]))
-    distances_from_origin = [manhattan_distance(Point(0,0), intersection) for intersection in intersections]
-    print(min(distances_from_origin))
-    print(fewest_steps)
+def _start_worker(wire_segment_lists):
+    global _worker_segments
+    _worker_segments = wire_segment_lists
+
+def _check_pairs(candidates):
+    results = {}
+
+    for (one, two), (indexes_one, indexes_two) in candidates:
+        result = _pair_result(_worker_segments, one, two, indexes_one, indexes_two)
+        if result is not None:
+            results[one, two] = result
+
+    return results
+
+if __name__ == "__main__":
+    wire_paths = [line.split(",") for line in read_file_to_list("input/03.txt") if line]
+    results = pairwise_closest_and_fewest(wire_paths)
+
+    if len(wire_paths) == 2:
+        closest, fewest_steps = results[0, 1]
+        print(closest)
+        print(fewest_steps)
+    else:
+        for (first, second), (closest, fewest_steps) in sorted(results.items()):
+            print(f"wires {first} and {second}: closest {closest}, fewest steps {fewest_steps}")
 
 class Test(unittest.TestCase):
     def test_unittest_is_working(self):
@@ -226,3 +547,123 @@ class Test(unittest.TestCase):
         fewest_steps = min(first_wire + second_wire for (first_wire, second_wire) in zip(steps[0], steps[1]))
 
         self.assertEqual(410, fewest_steps)
+
+    def test_trace_wire_keeps_the_first_visit(self):
+        points, steps = trace_wire(["R2", "U1", "L1", "D2"])
+
+        self.assertEqual(move_list_of_movements(["R2", "U1", "L1", "D2"]), points)
+        self.assertEqual(1, steps[Point(1, 0)])
+        self.assertEqual(6, steps[Point(1, -1)])
+
+    def test_fewest_combined_steps_examples(self):
+        examples = [
+            ("R75,D30,R83,U83,L12,D49,R71,U7,L72", "U62,R66,U55,R34,D71,R55,D58,R83", 610),
+            ("R98,U47,R26,D63,R33,U87,L62,D20,R33,U53,R51", "U98,R91,D20,R16,D67,R40,U7,R15,U6,R7", 410),
+        ]
+
+        for wire_one, wire_two, expected in examples:
+            steps = [trace_wire(wire.split(","))[1] for wire in (wire_one, wire_two)]
+
+            self.assertEqual(expected, fewest_combined_steps(steps[0], steps[1]))
+
+    def test_count_steps_handles_negative_indexes_like_a_slice(self):
+        self.assertEqual(3, count_steps([Point(0, y) for y in range(5)], -2))
+
+    def test_wire_segments_record_steps_taken(self):
+        segments = wire_segments(["R8", "U5", "L5"])
+
+        self.assertEqual([(0, 0, 8, 0, 0), (8, 0, 8, 5, 8), (8, 5, 3, 5, 13)], segments)
+
+    def test_closest_and_fewest_examples(self):
+        examples = [
+            ("R8,U5,L5,D3", "U7,R6,D4,L4", (6, 30)),
+            ("R75,D30,R83,U83,L12,D49,R71,U7,L72", "U62,R66,U55,R34,D71,R55,D58,R83", (159, 610)),
+            ("R98,U47,R26,D63,R33,U87,L62,D20,R33,U53,R51", "U98,R91,D20,R16,D67,R40,U7,R15,U6,R7", (135, 410)),
+        ]
+
+        for wire_one, wire_two, expected in examples:
+            self.assertEqual(expected, closest_and_fewest(wire_one.split(","), wire_two.split(",")))
+
+    def test_segment_intersections_find_overlapping_segments(self):
+        # the wires run along each other from (2, 0) to (4, 0)
+        crossings = segment_intersections(wire_segments(["R4"]), wire_segments(["U1", "R2", "D1", "R5"]))
+
+        self.assertEqual({(2, 0, 2, 4), (3, 0, 3, 5), (4, 0, 4, 6)}, set(crossings))
+
+    def test_segment_intersections_match_expanded_wires(self):
+        wires = [wire.split(",") for wire in ["R75,D30,R83,U83,L12,D49,R71,U7,L72", "U62,R66,U55,R34,D71,R55,D58,R83"]]
+        paths = [move_list_of_movements(wire) for wire in wires]
+
+        crossings = segment_intersections(wire_segments(wires[0]), wire_segments(wires[1]))
+
+        self.assertEqual(set(find_intersections(paths[0], paths[1])), {Point(x, y) for x, y, _, _ in crossings})
+
+    def test_pack_round_trips_negative_coordinates(self):
+        for x, y in ((0, 0), (3, -4), (-7, 2), (-(2 ** 31), 2 ** 31 - 1)):
+            self.assertEqual((x, y), unpack(pack(x, y)))
+
+    def test_point_uses_slots_and_packed_hash(self):
+        point = Point(3, -4)
+
+        self.assertFalse(hasattr(point, "__dict__"))
+        self.assertEqual(point, Point.from_key(point.key))
+        self.assertEqual(hash(point.key), hash(point))
+
+    def test_move_list_of_keys_matches_points(self):
+        movements = ["R2", "U2", "L3", "D4"]
+
+        keys = move_list_of_keys(movements)
+
+        self.assertEqual([point.key for point in move_list_of_movements(movements)], keys)
+
+    def test_closest_and_fewest_keys_matches_segments(self):
+        wires = [wire.split(",") for wire in ["R75,D30,R83,U83,L12,D49,R71,U7,L72", "U62,R66,U55,R34,D71,R55,D58,R83"]]
+
+        result = closest_and_fewest_keys(move_list_of_keys(wires[0]), move_list_of_keys(wires[1]))
+
+        self.assertEqual(closest_and_fewest(wires[0], wires[1]), result)
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_wire_array_matches_keys(self):
+        movements = ["R2", "U2", "L3", "D4", "R0"]
+
+        self.assertEqual(move_list_of_keys(movements), wire_array(movements).tolist())
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_closest_and_fewest_array_examples(self):
+        examples = [
+            ("R8,U5,L5,D3", "U7,R6,D4,L4", (6, 30)),
+            ("R98,U47,R26,D63,R33,U87,L62,D20,R33,U53,R51", "U98,R91,D20,R16,D67,R40,U7,R15,U6,R7", (135, 410)),
+        ]
+
+        for wire_one, wire_two, expected in examples:
+            arrays = [wire_array(wire.split(",")) for wire in (wire_one, wire_two)]
+
+            self.assertEqual(expected, closest_and_fewest_array(arrays[0], arrays[1]))
+
+    def test_grid_buckets_only_share_buckets_along_segments(self):
+        buckets = grid_buckets([wire_segments(["R25"]), wire_segments(["U25"])], 10)
+
+        self.assertEqual({0: [0], 1: [0]}, buckets[0, 0])
+        self.assertEqual({0: [0]}, buckets[2, 0])
+        self.assertEqual({1: [0]}, buckets[0, 2])
+
+    def test_pairwise_closest_and_fewest_matches_each_pair(self):
+        wires = [wire.split(",") for wire in ["R8,U5,L5,D3", "U7,R6,D4,L4", "R75,D30,R83,U83,L12,D49,R71,U7,L72", "L3,D9"]]
+
+        results = pairwise_closest_and_fewest(wires, bucket_size=4)
+
+        expected = {}
+        for one, two in combinations(range(len(wires)), 2):
+            try:
+                expected[one, two] = closest_and_fewest(wires[one], wires[two])
+            except ValueError:
+                pass
+        self.assertEqual(expected, results)
+
+    def test_pairwise_parallel_matches_serial(self):
+        wires = [wire.split(",") for wire in ["R8,U5,L5,D3", "U7,R6,D4,L4", "R75,D30,R83,U83,L12,D49,R71,U7,L72"]]
+
+        results = pairwise_closest_and_fewest_parallel(wires, workers=2, chunk_size=1)
+
+        self.assertEqual(pairwise_closest_and_fewest(wires), results)
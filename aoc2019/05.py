@@ -2,7 +2,9 @@ import sys
 import unittest
 from io import StringIO
 from enum import Enum
-from utils import read_file_to_list
+from intcode import IntcodeVM, load_program
+from intcode_checkpoint import resume, run_with_checkpoints
+from intcode_profile import profile_intcode
 
 
 class Pointer:
@@ -139,12 +141,26 @@ class Program:
 
 
 class Instruction:
+    _decoded = {}  # raw instruction int -> Instruction, shared across programs
+
     def __init__(self, operation, parameter_modes=None):
         self.operation = operation
         self.parameter_modes = parameter_modes
 
     @classmethod
     def from_int(cls, instruction):
+        # keyed on the raw int rather than the address, so a program that
+        # rewrites one of its own instructions simply looks up the new value
+        try:
+            return cls._decoded[instruction]
+        except KeyError:
+            decoded = cls.decode(instruction)
+            cls._decoded[instruction] = decoded
+
+            return decoded
+
+    @classmethod
+    def decode(cls, instruction):
         operation = cls._parse_operation(instruction)
         parameter_modes = cls._parse_parameter_modes(instruction)
 
@@ -165,7 +181,7 @@ class Instruction:
         return [Mode(int(i)) for i in str(instruction)[::-1][2:]]
 
 
-def process_intcode(intcode, intcode_input=sys.stdin, intcode_output=sys.stdout):
+def debug_intcode(intcode, intcode_input=sys.stdin, intcode_output=sys.stdout):
     program = Program.from_intcode(intcode)
     pointer = Pointer()
 
@@ -196,11 +212,24 @@ def process_intcode(intcode, intcode_input=sys.stdin, intcode_output=sys.stdout)
     return program._program
 
 
+def process_intcode(intcode, intcode_input=sys.stdin, intcode_output=sys.stdout):
+    return IntcodeVM(intcode, intcode_input, intcode_output).run()
+
+
 if __name__ == "__main__":
-    test_diagnostic_program = [
-        int(x) for x in read_file_to_list("input/05.txt")[0].split(",")
-    ]
-    process_intcode(test_diagnostic_program)
+    test_diagnostic_program = load_program("input/05.txt")
+
+    if "--profile" in sys.argv:
+        _, profile = profile_intcode(test_diagnostic_program)
+        print(profile.report(), file=sys.stderr)
+    elif "--resume" in sys.argv:
+        # carry on from the last checkpoint in the given log
+        resume(sys.argv[sys.argv.index("--resume") + 1], sys.stdin, sys.stdout)
+    elif "--checkpoint" in sys.argv:
+        log = sys.argv[sys.argv.index("--checkpoint") + 1]
+        run_with_checkpoints(IntcodeVM(test_diagnostic_program), log)
+    else:
+        process_intcode(test_diagnostic_program)
 
 
 class Test(unittest.TestCase):
@@ -272,6 +301,27 @@ class Test(unittest.TestCase):
         self.assertEqual(instruction.parameter_modes, [Mode.POSITION, Mode.IMMEDIATE])
         self.assertEqual(instruction.operation, Operation.MULTIPLICATION)
 
+    def test_instruction_from_int_reuses_decoded_instruction(self):
+        self.assertIs(Instruction.from_int(1002), Instruction.from_int(1002))
+
+    def test_debug_intcode_matches_process_intcode(self):
+        program = [3, 9, 8, 9, 10, 9, 4, 9, 99, -1, 8]
+        debug_output = StringIO()
+        output = StringIO()
+
+        debug_result = debug_intcode(program.copy(), StringIO("8\n"), debug_output)
+        result = process_intcode(program.copy(), StringIO("8\n"), output)
+
+        self.assertEqual(debug_result, result)
+        self.assertEqual(debug_output.getvalue(), output.getvalue())
+
+    def test_unknown_opcode_raises(self):
+        with self.assertRaises(ValueError):
+            process_intcode([42, 0, 0, 0, 99])
+
+    def test_instruction_decode_always_parses(self):
+        self.assertIsNot(Instruction.decode(1002), Instruction.decode(1002))
+
     def test_opcode_parameter_that_writes_will_not_be_in_immediate_mode(self):
         pass
 
@@ -0,0 +1,479 @@
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import timeit
+import tracemalloc
+from array import array
+from io import StringIO
+from intcode import IntcodeVM, Queue, compact_memory, run_batch
+from intcode_async import Network, relay
+from intcode_jit import DIAGNOSTIC, BlockVM, TranspiledVM
+from intcode_numpy import np, run_batch_lockstep
+from utils import read_file_to_list, read_intcode
+
+day_02 = importlib.import_module("02")
+day_03 = importlib.import_module("03")
+day_05 = importlib.import_module("05")
+
+
+def countdown(n):
+    # [add -1 to counter, jump to 0 if counter != 0, halt, counter]
+    return [1001, 8, -1, 8, 1005, 8, 0, 99, n]
+
+
+def countdown_steps(n):
+    return 2 * n + 1
+
+
+def bench_decode(repeat=5, number=100_000):
+    words = [1001, 1005, 99, 1002, 1108, 4]
+    uncached = min(
+        timeit.repeat(
+            lambda: [day_05.Instruction.decode(word) for word in words],
+            repeat=repeat,
+            number=number,
+        )
+    )
+    cached = min(
+        timeit.repeat(
+            lambda: [day_05.Instruction.from_int(word) for word in words],
+            repeat=repeat,
+            number=number,
+        )
+    )
+    decodes = len(words) * number
+
+    return {"uncached": decodes / uncached, "cached": decodes / cached}
+
+
+def bench_process_intcode(n=100_000, repeat=3):
+    elapsed = min(
+        timeit.repeat(
+            lambda: day_05.process_intcode(countdown(n)), repeat=repeat, number=1
+        )
+    )
+
+    return countdown_steps(n) / elapsed
+
+
+def bench_engines(n=100_000, repeat=3):
+    # steps/sec of each VM class on the countdown loop
+    results = {}
+
+    for engine in (IntcodeVM, BlockVM, TranspiledVM):
+        elapsed = min(
+            timeit.repeat(lambda: engine(countdown(n)).run(), repeat=repeat, number=1)
+        )
+        results[engine.__name__] = countdown_steps(n) / elapsed
+
+    return results
+
+
+def bench_memory(sizes=(1_000, 100_000), instances=(1, 10)):
+    # bytes held by `count` VMs of one program after every cell has been
+    # rewritten, which is where boxed ints cost the most
+    results = []
+
+    for size in sizes:
+        values = array("q", (random.randrange(10 ** 6) for _ in range(size)))
+
+        for count in instances:
+            for name, memory in (("list", list), ("array", compact_memory)):
+                tracemalloc.start()
+                vms = [IntcodeVM(values, memory=memory) for _ in range(count)]
+                for vm in vms:
+                    for address in range(size):
+                        vm.memory[address] += 1
+                allocated = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+                del vms
+
+                results.append((size, count, name, allocated))
+
+    return results
+
+
+def bench_loader(cells=1_000_000, repeat=3):
+    # MB/s parsing a synthetic program with the split-based loader the day
+    # scripts used to have, and with read_intcode
+    values = (str(random.randrange(-(10 ** 6), 10 ** 6)) for _ in range(cells))
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as fp:
+        fp.write(",".join(values) + "\n")
+    size = os.path.getsize(fp.name) / 10 ** 6
+
+    def peak(load):
+        tracemalloc.start()
+        load()
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return allocated / 10 ** 6
+
+    try:
+        split_peak = peak(
+            lambda: [int(x) for x in read_file_to_list(fp.name)[0].split(",")]
+        )
+        streamed_peak = peak(lambda: read_intcode(fp.name))
+        split = min(
+            timeit.repeat(
+                lambda: [int(x) for x in read_file_to_list(fp.name)[0].split(",")],
+                repeat=repeat,
+                number=1,
+            )
+        )
+        streamed = min(
+            timeit.repeat(lambda: read_intcode(fp.name), repeat=repeat, number=1)
+        )
+    finally:
+        os.remove(fp.name)
+
+    return {
+        "size": size,
+        "split": (size / split, split_peak),
+        "read_intcode": (size / streamed, streamed_peak),
+    }
+
+
+def bench_network(sizes=(1_000, 10_000), count=100, quantum=50):
+    # a chain of relay VMs that all count down concurrently before passing a
+    # token along, so the scheduler has to interleave every VM
+    results = []
+
+    for size in sizes:
+        network = Network(quantum)
+        for name in range(size):
+            network.add(name, relay(count))
+        network.chain(range(size))
+        network.nodes[0].send(0)
+
+        start = timeit.default_timer()
+        outputs = asyncio.run(network.run())
+        elapsed = timeit.default_timer() - start
+
+        assert outputs[size - 1] == [size]
+        results.append((size, elapsed, size * (2 * count + 4) / elapsed))
+
+    return results
+
+
+def bench_batch(runs=10_000, repeat=3):
+    # runs/sec of the day 5 diagnostic over many inputs, one process_intcode
+    # call per input against run_batch, and lock-step when numpy is there
+    inputs = [[value] for value in range(runs)]
+
+    def separately():
+        for values in inputs:
+            day_05.process_intcode(
+                list(DIAGNOSTIC), StringIO(f"{values[0]}\n"), StringIO()
+            )
+
+    separate = min(timeit.repeat(separately, repeat=repeat, number=1))
+    batched = min(
+        timeit.repeat(
+            lambda: list(run_batch(DIAGNOSTIC, inputs)), repeat=repeat, number=1
+        )
+    )
+
+    results = {"process_intcode": runs / separate, "run_batch": runs / batched}
+
+    if np is not None:
+        lockstep = min(
+            timeit.repeat(
+                lambda: list(run_batch_lockstep(DIAGNOSTIC, inputs)),
+                repeat=repeat,
+                number=1,
+            )
+        )
+        results["run_batch_lockstep"] = runs / lockstep
+
+    return results
+
+
+def random_wire(cells, segment=1_000, seed=0):
+    # a random walk of about `cells` cells in runs of up to `segment`
+    rng = random.Random(seed)
+    movements = []
+
+    while cells > 0:
+        amount = min(rng.randint(1, segment), cells)
+        movements.append(f"{rng.choice('UDLR')}{amount}")
+        cells -= amount
+
+    return movements
+
+
+def bench_wires(cells=1_000_000, repeat=3):
+    # seconds and peak MiB to answer day 3 for two long synthetic wires with
+    # Point paths, packed keys, segments and numpy arrays when available
+    wires = [random_wire(cells, seed=seed) for seed in (1, 2)]
+
+    def points():
+        traced = [day_03.trace_wire(wire) for wire in wires]
+        return day_03.fewest_combined_steps(traced[0][1], traced[1][1])
+
+    def keys():
+        keys = [day_03.move_list_of_keys(wire) for wire in wires]
+        return day_03.closest_and_fewest_keys(*keys)[1]
+
+    def segments():
+        return day_03.closest_and_fewest(*wires)[1]
+
+    def arrays():
+        arrays = [day_03.wire_array(wire) for wire in wires]
+        return day_03.closest_and_fewest_array(*arrays)[1]
+
+    engines = [("points", points), ("keys", keys), ("segments", segments)]
+    if day_03.np is not None:
+        engines.append(("numpy", arrays))
+
+    results = {}
+    for name, solve in engines:
+        tracemalloc.start()
+        answer = solve()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        seconds = min(timeit.repeat(solve, repeat=repeat, number=1))
+        results[name] = (seconds, peak / 2 ** 20, answer)
+
+    return results
+
+
+# synthetic workloads: each takes an iteration count and returns the program
+# and its input values; addresses are laid out by hand in the comments
+
+
+def arithmetic(n):
+    # T = I * 3; T += 7; A += T; I -= 1; loop while I
+    program = [1002, 20, 3, 21, 1001, 21, 7, 21, 1, 22, 21, 22, 1001, 20, -1, 20]
+    program += [1005, 20, 0, 99, n, 0, 0]
+
+    return program, []
+
+
+def branches(n):
+    # F = F == 0; if F: X += 1 else Y += 1; C = I < H; I -= 1; loop while I
+    program = [1008, 30, 0, 30, 1006, 30, 14, 1001, 31, 1, 31, 1105, 1, 18]
+    program += [1001, 32, 1, 32, 7, 33, 34, 35, 1001, 33, -1, 33, 1005, 33, 0, 99]
+    program += [0, 0, 0, n, n // 2, 0]
+
+    return program, []
+
+
+def io(n):
+    # read V; V *= 2; write V; I -= 1; loop while I
+    program = [3, 16, 1002, 16, 2, 16, 4, 16, 1001, 17, -1, 17, 1005, 17, 0, 99, 0, n]
+    values = random.Random(n).choices(range(-(10 ** 6), 10 ** 6), k=n)
+
+    return program, values
+
+
+def self_modifying(n):
+    # the instruction at 0 flips between A += B and A *= B every iteration
+    program = [1, 20, 21, 20, 1002, 0, -1, 0, 1001, 0, 3, 0, 1001, 22, -1, 22]
+    program += [1005, 22, 0, 99, 0, 1, n]
+
+    return program, []
+
+
+def large_memory(n, size=1_000_000):
+    # a short loop writing to the far end of a large, mostly empty image
+    last = size - 1
+    program = [1001, 12, -1, 12, 1, last, 12, last, 1005, 12, 0, 99, n]
+
+    return program + [0] * (size - len(program)), []
+
+
+WORKLOADS = {
+    "arithmetic": arithmetic,
+    "branches": branches,
+    "io": io,
+    "self_modifying": self_modifying,
+    "large_memory": large_memory,
+}
+
+
+def _run_vm(engine):
+    def run(program, values):
+        return engine(program, Queue(values), Queue()).run()
+
+    return run
+
+
+# engine name -> (run(program, input values) returning memory, handles I/O)
+ENGINES = {
+    "day02.process_intcode": (
+        lambda program, values: day_02.process_intcode(program),
+        False,
+    ),
+    "day05.process_intcode": (
+        lambda program, values: day_05.process_intcode(
+            program, StringIO("".join(f"{value}\n" for value in values)), StringIO()
+        ),
+        True,
+    ),
+    "day05.debug_intcode": (
+        lambda program, values: day_05.debug_intcode(
+            program, StringIO("".join(f"{value}\n" for value in values)), StringIO()
+        ),
+        True,
+    ),
+    "IntcodeVM": (_run_vm(IntcodeVM), True),
+    "BlockVM": (_run_vm(BlockVM), True),
+    "TranspiledVM": (_run_vm(TranspiledVM), True),
+}
+
+
+def count_steps(program, values):
+    vm = IntcodeVM(program, Queue(values), Queue())
+    steps = 0
+
+    while vm.step():
+        steps += 1
+
+    return steps
+
+
+def run_suite(n=20_000, repeat=3, workloads=None, engines=None):
+    results = []
+
+    for workload in workloads or WORKLOADS:
+        program, values = WORKLOADS[workload](n)
+        steps = count_steps(program, values)
+        expected = _run_vm(IntcodeVM)(program, values)
+
+        for engine in engines or ENGINES:
+            run, handles_io = ENGINES[engine]
+            if values and not handles_io:
+                continue
+
+            # programs are copied per run as debug_intcode works in place
+            matches = list(run(list(program), values)) == list(expected)
+            seconds = min(
+                timeit.repeat(
+                    lambda: run(list(program), values), repeat=repeat, number=1
+                )
+            )
+
+            tracemalloc.start()
+            run(list(program), values)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results.append(
+                {
+                    "workload": workload,
+                    "engine": engine,
+                    "steps": steps,
+                    "seconds": seconds,
+                    "steps_per_sec": steps / seconds,
+                    "peak_bytes": peak,
+                    "matches": matches,
+                }
+            )
+
+    return results
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path, results, n):
+    report = {
+        "commit": _commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "n": n,
+        "results": results,
+    }
+
+    with open(path, "w") as fp:
+        json.dump(report, fp, indent=2)
+
+
+def print_results(results, baseline=None):
+    previous = {}
+    if baseline is not None:
+        with open(baseline) as fp:
+            for result in json.load(fp)["results"]:
+                previous[result["workload"], result["engine"]] = result
+
+    for result in results:
+        line = (
+            f"{result['workload']:<15} {result['engine']:<22} "
+            f"{result['steps_per_sec']:>14,.0f} steps/sec "
+            f"{result['seconds']:8.3f}s {result['peak_bytes'] / 2 ** 20:8.2f} MiB"
+        )
+        if not result["matches"]:
+            line += "  MISMATCH"
+
+        before = previous.get((result["workload"], result["engine"]))
+        if before is not None:
+            line += f"  x{result['steps_per_sec'] / before['steps_per_sec']:.2f}"
+
+        print(line)
+
+
+def _print_extras():
+    decode = bench_decode()
+    print(f"decode (uncached): {decode['uncached']:,.0f} instructions/sec")
+    print(f"decode (cached):   {decode['cached']:,.0f} instructions/sec")
+    print(f"process_intcode:   {bench_process_intcode():,.0f} steps/sec")
+    for engine, steps in bench_engines().items():
+        print(f"{engine + ':':<18} {steps:,.0f} steps/sec")
+
+    for size, count, name, allocated in bench_memory():
+        mib = allocated / 2 ** 20
+        print(f"{count:>4} x {size:>7} cells ({name:>5}): {mib:8.2f} MiB")
+
+    loader = bench_loader()
+    print(f"loading {loader['size']:.1f} MB program:")
+    for name in ("split", "read_intcode"):
+        throughput, peak = loader[name]
+        print(f"  {name:>12}: {throughput:6.1f} MB/s, peak {peak:6.1f} MB")
+
+    for name, runs in bench_batch().items():
+        print(f"batch ({name}): {runs:,.0f} runs/sec")
+
+    for name, (seconds, peak, _) in bench_wires().items():
+        print(f"wires ({name}): {seconds:6.2f}s, peak {peak:8.1f} MiB")
+
+    for size, elapsed, steps in bench_network():
+        print(f"{size:>6} async VMs: {elapsed:6.2f}s, {steps:,.0f} steps/sec")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Intcode benchmarks")
+    parser.add_argument("-n", type=int, default=20_000, help="workload iterations")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workload", action="append", choices=WORKLOADS)
+    parser.add_argument("--engine", action="append", choices=ENGINES)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="results file to compare against")
+    parser.add_argument(
+        "--extras", action="store_true", help="also run the micro benchmarks"
+    )
+    args = parser.parse_args()
+
+    results = run_suite(args.n, args.repeat, args.workload, args.engine)
+    print_results(results, args.compare)
+    if args.json:
+        save_results(args.json, results, args.n)
+    if args.extras:
+        _print_extras()
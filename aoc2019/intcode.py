@@ -0,0 +1,1049 @@
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import unittest
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import StringIO
+from itertools import islice
+from utils import read_intcode
+
+ADDITION = 1
+MULTIPLICATION = 2
+INPUT = 3
+OUTPUT = 4
+JUMP_IF_TRUE = 5
+JUMP_IF_FALSE = 6
+LESS_THAN = 7
+EQUALS = 8
+HALT = 99
+
+
+def decode(instruction):
+    try:
+        return _DECODED[instruction]
+    except KeyError:
+        pass
+
+    modes, opcode = divmod(instruction, 100)
+
+    if instruction < 0 or (opcode != HALT and HANDLERS[opcode] is None):
+        raise ValueError(f"unknown opcode in instruction: {instruction}")
+    if not set(str(modes)) <= {"0", "1"}:
+        raise ValueError(f"unknown parameter mode in instruction: {instruction}")
+
+    _DECODED[instruction] = (opcode, modes % 10, modes // 10 % 10)
+    return _DECODED[instruction]
+
+
+def _addition(memory, ip, mode_a, mode_b, vm):
+    augend = memory[ip + 1] if mode_a else memory[memory[ip + 1]]
+    addend = memory[ip + 2] if mode_b else memory[memory[ip + 2]]
+
+    target = memory[ip + 3]
+    memory[target] = augend + addend
+    vm._dirty.add(target)
+    return ip + 4
+
+
+def _multiplication(memory, ip, mode_a, mode_b, vm):
+    multiplier = memory[ip + 1] if mode_a else memory[memory[ip + 1]]
+    multiplicand = memory[ip + 2] if mode_b else memory[memory[ip + 2]]
+
+    target = memory[ip + 3]
+    memory[target] = multiplier * multiplicand
+    vm._dirty.add(target)
+    return ip + 4
+
+
+def _input(memory, ip, mode_a, mode_b, vm):
+    target = memory[ip + 1]
+    value = vm.input.receive()
+    if value is None:
+        raise ValueError("intcode input is empty")
+
+    try:
+        memory[target] = value
+    except OverflowError:
+        # the value has been consumed, so finish the instruction on promoted
+        # memory instead of letting the caller retry it
+        vm._promote()[target] = value
+        vm._dirty.add(target)
+        vm.pointer = ip + 2
+        raise
+
+    vm._dirty.add(target)
+    return ip + 2
+
+
+def _output(memory, ip, mode_a, mode_b, vm):
+    vm.output.send(memory[ip + 1] if mode_a else memory[memory[ip + 1]])
+    return ip + 2
+
+
+def _jump_if_true(memory, ip, mode_a, mode_b, vm):
+    if (memory[ip + 1] if mode_a else memory[memory[ip + 1]]) != 0:
+        return memory[ip + 2] if mode_b else memory[memory[ip + 2]]
+
+    return ip + 3
+
+
+def _jump_if_false(memory, ip, mode_a, mode_b, vm):
+    if (memory[ip + 1] if mode_a else memory[memory[ip + 1]]) == 0:
+        return memory[ip + 2] if mode_b else memory[memory[ip + 2]]
+
+    return ip + 3
+
+
+def _less_than(memory, ip, mode_a, mode_b, vm):
+    a = memory[ip + 1] if mode_a else memory[memory[ip + 1]]
+    b = memory[ip + 2] if mode_b else memory[memory[ip + 2]]
+
+    target = memory[ip + 3]
+    memory[target] = 1 if a < b else 0
+    vm._dirty.add(target)
+    return ip + 4
+
+
+def _equals(memory, ip, mode_a, mode_b, vm):
+    a = memory[ip + 1] if mode_a else memory[memory[ip + 1]]
+    b = memory[ip + 2] if mode_b else memory[memory[ip + 2]]
+
+    target = memory[ip + 3]
+    memory[target] = 1 if a == b else 0
+    vm._dirty.add(target)
+    return ip + 4
+
+
+_DECODED = {}  # raw instruction int -> (opcode, mode_a, mode_b)
+WIDTHS = {
+    ADDITION: 4,
+    MULTIPLICATION: 4,
+    INPUT: 2,
+    OUTPUT: 2,
+    JUMP_IF_TRUE: 3,
+    JUMP_IF_FALSE: 3,
+    LESS_THAN: 4,
+    EQUALS: 4,
+    HALT: 1,
+}
+HANDLERS = [None] * 100
+HANDLERS[ADDITION] = _addition
+HANDLERS[MULTIPLICATION] = _multiplication
+HANDLERS[INPUT] = _input
+HANDLERS[OUTPUT] = _output
+HANDLERS[JUMP_IF_TRUE] = _jump_if_true
+HANDLERS[JUMP_IF_FALSE] = _jump_if_false
+HANDLERS[LESS_THAN] = _less_than
+HANDLERS[EQUALS] = _equals
+
+
+class Queue:
+    # in-memory channel, usable as one VM's output and another's input
+    def __init__(self, values=()):
+        self._values = deque(values)
+
+    def receive(self):
+        return self._values.popleft() if self._values else None
+
+    def send(self, value):
+        self._values.append(value)
+
+    def flush(self):
+        pass
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+
+class IterableInput:
+    def __init__(self, values):
+        self._values = iter(values)
+
+    def receive(self):
+        return next(self._values, None)
+
+
+class StreamInput:
+    # one int per line from a file-like object
+    def __init__(self, stream):
+        self._stream = stream
+
+    def receive(self):
+        line = self._stream.readline()
+        return int(line) if line else None
+
+
+class StreamOutput:
+    def __init__(self, stream):
+        self._stream = stream
+
+    def send(self, value):
+        self._stream.write(str(value))
+
+    def flush(self):
+        pass
+
+
+class BatchedOutput:
+    # collects values and writes them to the stream in one call per batch
+    def __init__(self, stream, batch_size=4096, end=""):
+        self._stream = stream
+        self._batch_size = batch_size
+        self._end = end
+        self._buffer = []
+
+    def send(self, value):
+        self._buffer.append(f"{value}{self._end}")
+
+        if len(self._buffer) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._stream.write("".join(self._buffer))
+            self._buffer.clear()
+
+
+def as_input(channel):
+    return channel if hasattr(channel, "receive") else StreamInput(channel)
+
+
+def as_output(channel):
+    return channel if hasattr(channel, "send") else StreamOutput(channel)
+
+
+def compact_memory(program):
+    # int64 cells, or a plain list if any value does not fit
+    try:
+        return array("q", program)
+    except OverflowError:
+        return list(program)
+
+
+PAGE_BITS = 12
+PAGE_SIZE = 1 << PAGE_BITS
+_PAGE_MASK = PAGE_SIZE - 1
+
+
+def _page(cells=()):
+    # one int64 page, zero filled past cells; a list if a value does not fit
+    try:
+        page = array("q", cells)
+        page.frombytes(bytes(8 * (PAGE_SIZE - len(page))))
+    except OverflowError:
+        page = list(cells)
+        page += [0] * (PAGE_SIZE - len(page))
+
+    return page
+
+
+class PagedMemory:
+    # sparse memory for programs that write far beyond their image: pages are
+    # allocated on first write and untouched cells read as zero, so the cost
+    # follows the cells touched rather than the highest address. Usable as
+    # the memory factory of an IntcodeVM.
+    def __init__(self, cells=()):
+        self._pages = {}
+
+        if isinstance(cells, PagedMemory):
+            for number, page in cells._pages.items():
+                self._pages[number] = page[:]
+            self._length = cells._length
+            return
+
+        self._length = len(cells)
+        for start in range(0, self._length, PAGE_SIZE):
+            chunk = cells[start : start + PAGE_SIZE]
+            if any(chunk):
+                self._pages[start >> PAGE_BITS] = _page(chunk)
+
+    def __len__(self):
+        # one past the highest address in the image or written since
+        return self._length
+
+    def __iter__(self):
+        for address in range(self._length):
+            yield self[address]
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return f"PagedMemory(length={self._length}, pages={len(self._pages)})"
+
+    def _address(self, address):
+        if address < 0:
+            address += self._length
+            if address < 0:
+                raise IndexError("intcode address out of range")
+
+        return address
+
+    def __getitem__(self, address):
+        if isinstance(address, slice):
+            return [self[i] for i in range(*address.indices(self._length))]
+
+        address = self._address(address)
+        page = self._pages.get(address >> PAGE_BITS)
+
+        return 0 if page is None else page[address & _PAGE_MASK]
+
+    def __setitem__(self, address, value):
+        address = self._address(address)
+        number = address >> PAGE_BITS
+        page = self._pages.get(number)
+
+        if page is None:
+            if not value and address < self._length:
+                return
+            page = self._pages[number] = _page()
+
+        try:
+            page[address & _PAGE_MASK] = value
+        except OverflowError:
+            page = self._pages[number] = list(page)
+            page[address & _PAGE_MASK] = value
+
+        if address >= self._length:
+            self._length = address + 1
+
+    @property
+    def pages(self):
+        return len(self._pages)
+
+
+class IntcodeVM:
+    def __init__(
+        self,
+        program,
+        intcode_input=sys.stdin,
+        intcode_output=sys.stdout,
+        memory=list,
+    ):
+        self._memory = memory
+        self._image = memory(program)
+        self.memory = memory(self._image)
+        self.pointer = 0
+        self.halted = False
+        self.input = as_input(intcode_input)
+        self.output = as_output(intcode_output)
+        # addresses written since the last reset/snapshot, split by whether
+        # take_journal() has handed them out yet
+        self._dirty = set()
+        self._taken = set()
+        # changed since the last take_journal() by a reset/snapshot dropping
+        # them from _dirty/_taken
+        self._untaken = set()
+
+    def poke(self, address, value):
+        try:
+            self.memory[address] = value
+        except OverflowError:
+            self._promote()[address] = value
+
+        self._dirty.add(address)
+
+    def take_journal(self):
+        # the addresses written since the last call, or every one since the
+        # reset/snapshot before it, so a caller such as a checkpoint only
+        # looks at what is new. reset() still puts them all back.
+        journal = self._dirty
+        self._dirty = set()
+        self._taken |= journal
+
+        if self._untaken:
+            journal |= self._untaken
+            self._untaken = set()
+
+        return journal
+
+    def _written(self):
+        # every address written since the last reset/snapshot
+        return self._dirty | self._taken if self._taken else self._dirty
+
+    def snapshot(self):
+        # make the current memory the image that reset() restores
+        self._image = self._memory(self.memory)
+        self._untaken |= self._dirty
+        self._dirty.clear()
+        self._taken.clear()
+
+    def reset(self):
+        # undo only the cells written since the last reset, so the cost
+        # scales with what the previous run touched rather than program size
+        memory = self.memory
+        image = self._image
+
+        if len(memory) != len(image):
+            # sparse memory grew past the image, so start again from it
+            self.memory = self._memory(image)
+        else:
+            for address in self._written():
+                memory[address] = image[address]
+
+        # cells written since the last take_journal() are back as they were
+        # then; the ones taken before it are not
+        self._untaken |= self._taken
+        self._dirty.clear()
+        self._taken.clear()
+        self.pointer = 0
+        self.halted = False
+
+    def _promote(self):
+        # array memory overflowed, so carry on with arbitrary precision ints;
+        # paged memory promotes its own pages
+        if type(self.memory) is array:
+            self.memory = list(self.memory)
+
+        return self.memory
+
+    def step(self):
+        memory = self.memory
+        ip = self.pointer
+
+        if self.halted or ip >= len(memory):
+            return False
+
+        opcode, mode_a, mode_b = decode(memory[ip])
+
+        if opcode == HALT:
+            self.halted = True
+            self.output.flush()
+            return False
+
+        try:
+            self.pointer = HANDLERS[opcode](memory, ip, mode_a, mode_b, self)
+        except OverflowError:
+            memory = self._promote()
+
+            if self.pointer == ip:
+                self.pointer = HANDLERS[opcode](memory, ip, mode_a, mode_b, self)
+
+        return True
+
+    def run(self):
+        memory = self.memory
+        ip = self.pointer
+        decoded = _DECODED
+        handlers = HANDLERS
+
+        while not self.halted and ip < len(memory):
+            try:
+                opcode, mode_a, mode_b = decoded[memory[ip]]
+            except KeyError:
+                opcode, mode_a, mode_b = decode(memory[ip])
+
+            if opcode == HALT:
+                self.halted = True
+                break
+
+            try:
+                ip = self.pointer = handlers[opcode](memory, ip, mode_a, mode_b, self)
+            except OverflowError:
+                memory = self._promote()
+                ip = self.pointer
+
+        self.output.flush()
+        return self.memory
+
+    def execute(self, quantum=None):
+        # generator version of run(): yields each output value instead of
+        # sending it, and yields NEEDS_INPUT when the input channel is empty,
+        # expecting the value back through send(). Resuming with next()
+        # checks the input channel again. With a quantum it also yields
+        # PAUSED after every that many instructions.
+        memory = self.memory
+        ip = self.pointer
+        decoded = _DECODED
+        handlers = HANDLERS
+        remaining = quantum or -1
+
+        while not self.halted and ip < len(memory):
+            remaining -= 1
+            if remaining == 0:
+                remaining = quantum
+                yield PAUSED
+
+            try:
+                opcode, mode_a, mode_b = decoded[memory[ip]]
+            except KeyError:
+                opcode, mode_a, mode_b = decode(memory[ip])
+
+            if opcode == HALT:
+                self.halted = True
+                break
+            elif opcode == INPUT:
+                value = self.input.receive()
+                while value is None:
+                    value = yield NEEDS_INPUT
+                    if value is None:
+                        value = self.input.receive()
+
+                self.poke(memory[ip + 1], value)
+                memory = self.memory
+                ip = self.pointer = ip + 2
+            elif opcode == OUTPUT:
+                ip = self.pointer = ip + 2
+                yield memory[ip - 1] if mode_a else memory[memory[ip - 1]]
+            else:
+                try:
+                    ip = self.pointer = handlers[opcode](
+                        memory, ip, mode_a, mode_b, self
+                    )
+                except OverflowError:
+                    memory = self._promote()
+                    ip = self.pointer
+
+
+NEEDS_INPUT = object()  # yielded by IntcodeVM.execute() when it is starved
+PAUSED = object()  # yielded by IntcodeVM.execute() when its quantum runs out
+
+
+def run_pipeline(vms, signal=0, feedback=False):
+    # chain VMs whose inputs are Queues, each one's outputs feeding the next,
+    # with the last feeding the first when feedback is set. Returns the last
+    # value the final VM produced.
+    runs = [vm.execute() for vm in vms]
+    last = None
+    vms[0].input.send(signal)
+
+    while any(runs):
+        progressed = False
+
+        for index, run in enumerate(runs):
+            if run is None:
+                continue
+
+            downstream = index + 1 < len(vms) or feedback
+            for value in run:
+                if value is NEEDS_INPUT:
+                    break
+                elif value is PAUSED:
+                    continue
+
+                progressed = True
+                if index == len(vms) - 1:
+                    last = value
+                if downstream:
+                    vms[(index + 1) % len(vms)].input.send(value)
+            else:
+                runs[index] = None
+                progressed = True
+
+        if not progressed:
+            raise ValueError("intcode pipeline is waiting for input")
+
+    return last
+
+
+def run_batch(program, inputs):
+    # runs the program once per input sequence, yielding (index, outputs).
+    # A single VM is reset between runs, so only the cells the last run
+    # wrote are copied back and every run shares the decode cache.
+    vm = IntcodeVM(program, Queue(), Queue())
+
+    for index, values in enumerate(inputs):
+        yield index, _run_batch_item(vm, values)
+
+
+def run_batch_parallel(program, inputs, workers=None, chunk_size=64):
+    # run_batch spread over worker processes that each build the VM once.
+    # Inputs go out in chunks and results are yielded as chunks complete,
+    # so they are not in index order.
+    with ProcessPoolExecutor(
+        workers, initializer=_start_batch_worker, initargs=(program,)
+    ) as executor:
+        futures = []
+        inputs = iter(inputs)
+        start = 0
+
+        for chunk in iter(lambda: list(islice(inputs, chunk_size)), []):
+            futures.append(executor.submit(_run_batch_chunk, start, chunk))
+            start += len(chunk)
+
+        try:
+            for future in as_completed(futures):
+                yield from future.result()
+        finally:
+            for pending in futures:
+                pending.cancel()
+
+
+def _run_batch_item(vm, values):
+    vm.reset()
+    vm.input = Queue(values)
+    vm.output = Queue()
+    vm.run()
+
+    return list(vm.output)
+
+
+_batch_vm = None
+
+
+def _start_batch_worker(program):
+    global _batch_vm
+    _batch_vm = IntcodeVM(program, Queue(), Queue())
+
+
+def _run_batch_chunk(start, chunk):
+    return [
+        (start + offset, _run_batch_item(_batch_vm, values))
+        for offset, values in enumerate(chunk)
+    ]
+
+
+# image layout: header, then cell_count little-endian int64 cells. Loading
+# is one mmap copy with no text parsing.
+IMAGE_MAGIC = b"ICIM"
+IMAGE_VERSION = 2
+_IMAGE_HEADER = struct.Struct("<4sHQ")  # magic, version, cell count
+
+
+def write_image(path, program):
+    cells = compact_memory(program)
+    if type(cells) is not array:
+        raise ValueError("intcode images can only hold 64 bit cells")
+
+    if sys.byteorder == "big":
+        cells.byteswap()
+
+    # written beside the target and renamed over it, so an interrupted write
+    # never leaves a truncated image that load_program would trust
+    descriptor, temporary = tempfile.mkstemp(
+        suffix=".tmp", dir=os.path.dirname(os.path.abspath(path))
+    )
+    try:
+        with os.fdopen(descriptor, "wb") as fp:
+            fp.write(_IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, len(cells)))
+            fp.write(cells.tobytes())
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def read_image(path):
+    cells = array("q")
+
+    with open(path, "rb") as fp, mmap.mmap(
+        fp.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        try:
+            magic, version, count = _IMAGE_HEADER.unpack_from(mapped)
+        except struct.error:
+            raise ValueError(f"truncated intcode image: {path}") from None
+        if magic != IMAGE_MAGIC or version != IMAGE_VERSION:
+            raise ValueError(f"not a version {IMAGE_VERSION} intcode image: {path}")
+
+        start = _IMAGE_HEADER.size
+        end = start + count * cells.itemsize
+        if len(mapped) < end:
+            raise ValueError(f"truncated intcode image: {path}")
+
+        view = memoryview(mapped)
+        try:
+            cells.frombytes(view[start:end])
+        finally:
+            view.release()
+
+    if sys.byteorder == "big":
+        cells.byteswap()
+
+    return cells
+
+
+def load_program(path):
+    # use the image cached next to a text program, rebuilding it when the
+    # text is newer
+    image_path = os.path.splitext(path)[0] + ".ici"
+
+    try:
+        if os.path.getmtime(image_path) >= os.path.getmtime(path):
+            return read_image(image_path)
+    except (OSError, ValueError):
+        pass
+
+    program = read_intcode(path)
+    try:
+        write_image(image_path, program)
+    except (OSError, ValueError):
+        pass
+
+    return program
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit(f"usage: {sys.argv[0]} program.txt program.ici")
+
+    write_image(sys.argv[2], read_intcode(sys.argv[1]))
+
+
+class Test(unittest.TestCase):
+    def test_decode_splits_opcode_and_modes(self):
+        self.assertEqual((2, 0, 1), decode(1002))
+        self.assertEqual((99, 0, 0), decode(99))
+
+    def test_decode_rejects_unknown_opcodes(self):
+        with self.assertRaises(ValueError):
+            decode(42)
+        with self.assertRaises(ValueError):
+            decode(-1)
+
+    def test_decode_rejects_unknown_modes(self):
+        with self.assertRaises(ValueError):
+            decode(1201)
+
+    def test_run_does_not_mutate_program(self):
+        program = [1, 0, 0, 0, 99]
+
+        result = IntcodeVM(program).run()
+
+        self.assertEqual([2, 0, 0, 0, 99], result)
+        self.assertEqual([1, 0, 0, 0, 99], program)
+
+    def test_step_executes_one_instruction(self):
+        vm = IntcodeVM([1, 0, 0, 0, 2, 0, 0, 0, 99])
+
+        self.assertTrue(vm.step())
+        self.assertEqual([2, 0, 0, 0, 2, 0, 0, 0, 99], vm.memory)
+        self.assertEqual(4, vm.pointer)
+        self.assertTrue(vm.step())
+        self.assertFalse(vm.step())
+        self.assertTrue(vm.halted)
+        self.assertEqual(4, vm.memory[0])
+
+    def test_reset_restores_program(self):
+        vm = IntcodeVM([1, 0, 0, 0, 99])
+        vm.run()
+
+        vm.reset()
+
+        self.assertEqual([1, 0, 0, 0, 99], vm.memory)
+        self.assertEqual(0, vm.pointer)
+        self.assertFalse(vm.halted)
+        self.assertEqual([2, 0, 0, 0, 99], vm.run())
+
+    def test_reset_only_restores_written_cells(self):
+        vm = IntcodeVM([1, 0, 0, 0, 2, 5, 5, 5, 99])
+        vm.run()
+
+        self.assertEqual({0, 5}, vm._dirty)
+        vm.reset()
+
+        self.assertEqual(set(), vm._dirty)
+        self.assertEqual([1, 0, 0, 0, 2, 5, 5, 5, 99], vm.memory)
+
+    def test_take_journal_hands_out_each_write_once(self):
+        vm = IntcodeVM([1, 0, 0, 0, 99])
+        vm.poke(1, 4)
+        self.assertEqual({1}, vm.take_journal())
+
+        vm.run()
+        self.assertEqual({0}, vm.take_journal())
+        self.assertEqual(set(), vm.take_journal())
+
+        vm.reset()
+
+        self.assertEqual([1, 0, 0, 0, 99], vm.memory)
+        self.assertEqual({0, 1}, vm.take_journal())
+
+    def test_reset_undoes_pokes(self):
+        vm = IntcodeVM([1, 0, 0, 0, 99])
+        vm.poke(1, 4)
+        self.assertEqual([100, 4, 0, 0, 99], vm.run())
+
+        vm.reset()
+
+        self.assertEqual([1, 0, 0, 0, 99], vm.memory)
+
+    def test_snapshot_changes_what_reset_restores(self):
+        vm = IntcodeVM([1, 0, 0, 0, 99])
+        vm.poke(1, 4)
+        vm.snapshot()
+        vm.run()
+
+        vm.reset()
+
+        self.assertEqual([1, 4, 0, 0, 99], vm.memory)
+
+    def test_queue_channels(self):
+        intcode_output = Queue()
+        vm = IntcodeVM([3, 0, 4, 0, 3, 0, 4, 0, 99], Queue([5, 6]), intcode_output)
+
+        vm.run()
+
+        self.assertEqual([5, 6], list(intcode_output))
+
+    def test_iterable_input(self):
+        intcode_output = Queue()
+        vm = IntcodeVM([3, 0, 4, 0, 99], IterableInput(range(7, 10)), intcode_output)
+
+        vm.run()
+
+        self.assertEqual([7], list(intcode_output))
+
+    def test_empty_input_raises(self):
+        with self.assertRaises(ValueError):
+            IntcodeVM([3, 0, 99], Queue()).run()
+        with self.assertRaises(ValueError):
+            IntcodeVM([3, 0, 99], StringIO("")).run()
+
+    def test_batched_output_writes_in_batches(self):
+        stream = StringIO()
+        intcode_output = BatchedOutput(stream, batch_size=2, end="\n")
+
+        for value in (1, 2, 3):
+            intcode_output.send(value)
+
+        self.assertEqual("1\n2\n", stream.getvalue())
+        intcode_output.flush()
+        self.assertEqual("1\n2\n3\n", stream.getvalue())
+
+    def test_run_flushes_batched_output(self):
+        stream = StringIO()
+        vm = IntcodeVM([104, 1, 104, 2, 99], intcode_output=BatchedOutput(stream))
+
+        vm.run()
+
+        self.assertEqual("12", stream.getvalue())
+
+    def test_execute_yields_outputs(self):
+        vm = IntcodeVM([104, 1, 104, 2, 99])
+
+        self.assertEqual([1, 2], list(vm.execute()))
+        self.assertTrue(vm.halted)
+
+    def test_execute_waits_for_input(self):
+        vm = IntcodeVM([3, 0, 4, 0, 3, 0, 4, 0, 99], Queue([5]))
+        run = vm.execute()
+
+        self.assertEqual(5, next(run))
+        self.assertIs(NEEDS_INPUT, next(run))
+        self.assertEqual(4, vm.pointer)
+        self.assertIs(NEEDS_INPUT, next(run))
+        self.assertEqual(6, run.send(6))
+        self.assertEqual([], list(run))
+        self.assertEqual([6, 0, 4, 0, 3, 0, 4, 0, 99], vm.memory)
+
+    def test_execute_pauses_every_quantum(self):
+        vm = IntcodeVM([1001, 8, -1, 8, 1005, 8, 0, 99, 3])
+        run = vm.execute(quantum=2)
+
+        self.assertIs(PAUSED, next(run))
+        self.assertEqual(4, vm.pointer)
+        self.assertEqual(2, sum(1 for signal in run if signal is PAUSED))
+        self.assertEqual(0, vm.memory[8])
+
+    def test_pipeline_chains_amplifiers(self):
+        program = [3, 15, 3, 16, 1002, 16, 10, 16, 1, 16, 15, 15, 4, 15, 99, 0, 0]
+        vms = [IntcodeVM(program, Queue([phase])) for phase in (4, 3, 2, 1, 0)]
+
+        self.assertEqual(43210, run_pipeline(vms))
+
+    def test_pipeline_with_feedback_loop(self):
+        program = "3,26,1001,26,-4,26,3,27,1002,27,2,27,1,27,26,27,4,27,1001,28,-1,28,1005,28,6,99,0,0,5"
+        program = [int(x) for x in program.split(",")]
+        vms = [IntcodeVM(program, Queue([phase])) for phase in (9, 8, 7, 6, 5)]
+
+        self.assertEqual(139629729, run_pipeline(vms, feedback=True))
+
+    def test_pipeline_raises_when_starved(self):
+        vms = [IntcodeVM([3, 0, 3, 0, 99], Queue()) for _ in range(2)]
+
+        with self.assertRaises(ValueError):
+            run_pipeline(vms)
+
+    def test_run_batch_resets_between_runs(self):
+        # adds its input to a counter at 9 and outputs it, then halts
+        program = [3, 10, 1, 9, 10, 9, 4, 9, 99, 0, 0]
+
+        results = list(run_batch(program, [[1], [2], [3]]))
+
+        self.assertEqual([(0, [1]), (1, [2]), (2, [3])], results)
+
+    def test_run_batch_parallel_matches_run_batch(self):
+        program = [3, 10, 1, 9, 10, 9, 4, 9, 99, 0, 0]
+        inputs = [[value] for value in range(10)]
+
+        results = run_batch_parallel(program, inputs, workers=2, chunk_size=3)
+
+        self.assertEqual(list(run_batch(program, inputs)), sorted(results))
+
+    def test_compact_memory_uses_int64_array(self):
+        vm = IntcodeVM([1, 0, 0, 0, 99], memory=compact_memory)
+
+        self.assertEqual(array("q", [2, 0, 0, 0, 99]), vm.run())
+
+    def test_compact_memory_falls_back_to_list_for_big_values(self):
+        self.assertEqual([2 ** 70, 99], compact_memory([2 ** 70, 99]))
+
+    def test_compact_memory_promotes_on_overflow(self):
+        vm = IntcodeVM([1002, 5, 2 ** 40, 5, 99, 2 ** 40], memory=compact_memory)
+
+        result = vm.run()
+
+        self.assertIs(list, type(result))
+        self.assertEqual([1002, 5, 2 ** 40, 5, 99, 2 ** 80], result)
+
+    def test_compact_memory_promotes_when_stepping(self):
+        vm = IntcodeVM([1002, 5, 2 ** 40, 5, 99, 2 ** 40], memory=compact_memory)
+
+        self.assertTrue(vm.step())
+
+        self.assertEqual(4, vm.pointer)
+        self.assertEqual(2 ** 80, vm.memory[5])
+
+    def test_compact_memory_promotes_on_input_overflow(self):
+        vm = IntcodeVM(
+            [3, 0, 3, 1, 99], StringIO(f"{2 ** 64}\n7\n"), memory=compact_memory
+        )
+
+        self.assertEqual([2 ** 64, 7, 3, 1, 99], vm.run())
+
+    def test_compact_memory_resets_after_promotion(self):
+        vm = IntcodeVM([1002, 5, 2 ** 40, 5, 99, 2 ** 40], memory=compact_memory)
+        vm.run()
+
+        vm.reset()
+
+        self.assertEqual([1002, 5, 2 ** 40, 5, 99, 2 ** 40], vm.memory)
+
+    def test_paged_memory_reads_zero_for_untouched_cells(self):
+        memory = PagedMemory([1, 2, 3])
+
+        self.assertEqual([1, 2, 3], list(memory))
+        self.assertEqual([2, 3], memory[1:])
+        self.assertEqual(0, memory[10 ** 9])
+        self.assertEqual(3, len(memory))
+
+    def test_paged_memory_only_allocates_written_pages(self):
+        memory = PagedMemory()
+
+        for address in range(0, 10 ** 12, 10 ** 11):
+            memory[address] = address
+
+        self.assertEqual(10, memory.pages)
+        self.assertEqual(9 * 10 ** 11 + 1, len(memory))
+        self.assertEqual(3 * 10 ** 11, memory[3 * 10 ** 11])
+
+    def test_paged_memory_promotes_a_page_on_overflow(self):
+        memory = PagedMemory([1, 2])
+
+        memory[PAGE_SIZE + 1] = 2 ** 70
+
+        self.assertEqual(2 ** 70, memory[PAGE_SIZE + 1])
+        self.assertIs(list, type(memory._pages[1]))
+        self.assertIs(array, type(memory._pages[0]))
+
+    def test_paged_memory_runs_writes_past_the_image(self):
+        vm = IntcodeVM([1101, 1, 2, 10 ** 9, 99], memory=PagedMemory)
+
+        memory = vm.run()
+
+        self.assertEqual(3, memory[10 ** 9])
+        self.assertEqual(10 ** 9 + 1, len(memory))
+        self.assertEqual(2, memory.pages)  # the image and the far write
+
+    def test_paged_memory_resets_to_the_image(self):
+        vm = IntcodeVM([1101, 1, 2, 10 ** 9, 99], memory=PagedMemory)
+        vm.run()
+
+        vm.reset()
+
+        self.assertEqual([1101, 1, 2, 10 ** 9, 99], vm.memory)
+        self.assertEqual(3, vm.run()[10 ** 9])
+
+    def test_io_is_pluggable(self):
+        intcode_output = StringIO()
+        vm = IntcodeVM([3, 0, 4, 0, 99], StringIO("66\n"), intcode_output)
+
+        vm.run()
+
+        self.assertEqual("66", intcode_output.getvalue())
+
+    def test_image_round_trips_program(self):
+        program = [1002, 4, 3, 4, 33, -7, 2 ** 62]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "program.ici")
+            write_image(path, program)
+
+            self.assertEqual(array("q", program), read_image(path))
+
+    def test_image_rejects_big_values(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(ValueError):
+                write_image(os.path.join(directory, "program.ici"), [2 ** 64])
+
+    def test_image_rejects_other_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "program.ici")
+            with open(path, "wb") as fp:
+                fp.write(b"1,0,0,0,99\n" * 4)
+
+            with self.assertRaises(ValueError):
+                read_image(path)
+
+    def test_image_rejects_truncated_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "program.ici")
+            write_image(path, [1, 0, 0, 0, 99])
+            with open(path, "rb") as fp:
+                data = fp.read()
+
+            # inside the header, and inside the cells
+            for size in (4, _IMAGE_HEADER.size + 5 * 8 - 3):
+                with open(path, "wb") as fp:
+                    fp.write(data[:size])
+
+                with self.assertRaises(ValueError):
+                    read_image(path)
+
+    def test_image_rejects_older_versions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "program.ici")
+            with open(path, "wb") as fp:
+                fp.write(struct.pack("<4sHHQ", IMAGE_MAGIC, 1, 0, 1))
+                fp.write(struct.pack("<q", 99))
+
+            with self.assertRaises(ValueError):
+                read_image(path)
+
+    def test_load_program_replaces_a_broken_image(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "program.txt")
+            with open(path, "w") as fp:
+                fp.write("1,0,0,0,99\n")
+            with open(os.path.join(directory, "program.ici"), "wb") as fp:
+                fp.write(IMAGE_MAGIC)
+
+            self.assertEqual(array("q", [1, 0, 0, 0, 99]), load_program(path))
+            self.assertEqual(
+                array("q", [1, 0, 0, 0, 99]),
+                read_image(os.path.join(directory, "program.ici")),
+            )
+            self.assertEqual(
+                ["program.ici", "program.txt"], sorted(os.listdir(directory))
+            )
+
+    def test_load_program_caches_an_image(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "program.txt")
+            with open(path, "w") as fp:
+                fp.write("1,0,0,0,99\n")
+
+            self.assertEqual(array("q", [1, 0, 0, 0, 99]), load_program(path))
+            self.assertTrue(os.path.exists(os.path.join(directory, "program.ici")))
+            self.assertEqual(array("q", [1, 0, 0, 0, 99]), load_program(path))
@@ -0,0 +1,163 @@
+import asyncio
+import unittest
+from intcode import NEEDS_INPUT, PAUSED, IntcodeVM, Queue
+
+DEFAULT_QUANTUM = 1000  # instructions a VM runs before letting others go
+
+
+class AsyncVM:
+    def __init__(self, program, inputs=(), quantum=DEFAULT_QUANTUM):
+        self.vm = IntcodeVM(program, Queue(inputs), Queue())
+        self.inbox = asyncio.Queue()
+        self.downstream = []
+        self.outputs = []
+        self.quantum = quantum
+        self.network = None
+        self._waiting = False
+
+    def send(self, value):
+        self.inbox.put_nowait(value)
+
+        if self._waiting:
+            self._waiting = False
+            if self.network is not None:
+                self.network._unblock()
+
+    async def run(self):
+        execution = self.vm.execute(self.quantum)
+        value = None
+
+        try:
+            while True:
+                signal = execution.send(value)
+                value = None
+
+                if signal is PAUSED:
+                    await asyncio.sleep(0)
+                elif signal is NEEDS_INPUT:
+                    value = await self._receive()
+                else:
+                    self.outputs.append(signal)
+                    for node in self.downstream:
+                        node.send(signal)
+        except StopIteration:
+            pass
+        finally:
+            if self.network is not None:
+                self.network._finish()
+
+        return self.outputs
+
+    async def _receive(self):
+        if self.inbox.empty():
+            self._waiting = True
+            if self.network is not None:
+                self.network._block()
+
+        return await self.inbox.get()
+
+
+class Network:
+    def __init__(self, quantum=DEFAULT_QUANTUM):
+        self.nodes = {}
+        self.quantum = quantum
+        self._running = 0
+        self._blocked = 0
+
+    def add(self, name, program, inputs=()):
+        node = AsyncVM(program, inputs, self.quantum)
+        node.network = self
+        self.nodes[name] = node
+
+        return node
+
+    def connect(self, source, destination):
+        self.nodes[source].downstream.append(self.nodes[destination])
+
+    def chain(self, names, loop=False):
+        names = list(names)
+
+        for source, destination in zip(names, names[1:]):
+            self.connect(source, destination)
+        if loop and names:
+            self.connect(names[-1], names[0])
+
+    async def run(self):
+        # runs every VM to completion and returns their outputs by name
+        self._running = len(self.nodes)
+        self._blocked = 0
+        outputs = await asyncio.gather(*(node.run() for node in self.nodes.values()))
+
+        return dict(zip(self.nodes, outputs))
+
+    def _block(self):
+        self._blocked += 1
+        self._check_deadlock()
+
+    def _unblock(self):
+        self._blocked -= 1
+
+    def _finish(self):
+        self._running -= 1
+        self._check_deadlock()
+
+    def _check_deadlock(self):
+        if self._running and self._blocked == self._running:
+            raise ValueError("every running intcode VM is waiting for input")
+
+
+def relay(count=0):
+    # count down from count, then read a value, add one and output it
+    return [1001, 16, -1, 16, 1005, 16, 0, 3, 17, 1001, 17, 1, 17, 4, 17, 99, count, 0]
+
+
+class Test(unittest.TestCase):
+    def test_async_vm_runs_alone(self):
+        node = AsyncVM([3, 0, 4, 0, 99], inputs=[7])
+
+        self.assertEqual([7], asyncio.run(node.run()))
+
+    def test_async_vm_waits_for_its_inbox(self):
+        async def feed_later(node):
+            await asyncio.sleep(0)
+            node.send(9)
+
+        async def main():
+            node = AsyncVM([3, 0, 4, 0, 99])
+            outputs, _ = await asyncio.gather(node.run(), feed_later(node))
+            return outputs
+
+        self.assertEqual([9], asyncio.run(main()))
+
+    def test_network_chain(self):
+        network = Network(quantum=3)
+        for name in "abc":
+            network.add(name, relay(count=5))
+        network.chain("abc")
+        network.nodes["a"].send(0)
+
+        outputs = asyncio.run(network.run())
+
+        self.assertEqual({"a": [1], "b": [2], "c": [3]}, outputs)
+
+    def test_network_loop_of_amplifiers(self):
+        program = "3,26,1001,26,-4,26,3,27,1002,27,2,27,1,27,26,27,4,27,1001,28,-1,28,1005,28,6,99,0,0,5"
+        program = [int(x) for x in program.split(",")]
+        network = Network()
+        for phase in (9, 8, 7, 6, 5):
+            network.add(phase, program, inputs=[phase])
+        network.chain((9, 8, 7, 6, 5), loop=True)
+        network.nodes[9].send(0)
+
+        outputs = asyncio.run(network.run())
+
+        self.assertEqual(139629729, outputs[5][-1])
+
+    def test_network_raises_on_deadlock(self):
+        network = Network()
+        network.add("a", [3, 0, 99])
+        network.add("b", [3, 0, 99])
+        network.chain("ab", loop=True)
+
+        with self.assertRaises(ValueError):
+            asyncio.run(network.run())
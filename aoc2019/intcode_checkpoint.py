@@ -0,0 +1,400 @@
+import os
+import struct
+import sys
+import tempfile
+import unittest
+from array import array
+from intcode import (
+    NEEDS_INPUT,
+    PAGE_BITS,
+    PAGE_SIZE,
+    PAUSED,
+    IntcodeVM,
+    PagedMemory,
+    Queue,
+)
+
+# log layout: header, then length-prefixed records appended one per
+# checkpoint. A record holds the pointer, halted flag, cell count, pending
+# queue I/O and every page that changed since the record before it; the
+# first record has them all. A torn record at the end is ignored.
+CHECKPOINT_MAGIC = b"ICCP"
+CHECKPOINT_VERSION = 1
+_CHECKPOINT_HEADER = struct.Struct("<4sH")  # magic, version
+_LENGTH = struct.Struct("<Q")
+_STATE = struct.Struct("<qBQ")  # pointer, halted, cell count
+_INT64_PAGE = b"q"  # little-endian int64 cells
+_TEXT_PAGE = b"t"  # comma separated decimal, for cells wider than 64 bits
+
+DEFAULT_EVERY = 100_000  # instructions between checkpoints
+
+
+def _encode_page(cells):
+    try:
+        page = array("q", cells)
+    except OverflowError:
+        return _TEXT_PAGE + ",".join(map(str, cells)).encode()
+
+    if sys.byteorder == "big":
+        page.byteswap()
+
+    return _INT64_PAGE + page.tobytes()
+
+
+def _decode_page(data):
+    if data[:1] == _TEXT_PAGE:
+        return [int(value) for value in data[1:].split(b",")]
+
+    page = array("q")
+    page.frombytes(data[1:])
+    if sys.byteorder == "big":
+        page.byteswap()
+
+    return page
+
+
+def _encode_values(values):
+    return ",".join(map(str, values)).encode()
+
+
+def _decode_values(data):
+    return [int(value) for value in data.split(b",")] if data else []
+
+
+def _blob(data):
+    return _LENGTH.pack(len(data)) + data
+
+
+class Checkpointer:
+    # appends the state of a VM to a log whenever checkpoint() is called.
+    # Each checkpoint takes the VM's write journal, so only pages written
+    # since the last checkpoint are re-encoded and compared with what was
+    # last written. Frequent checkpoints stay cheap however long the run has
+    # been going.
+    def __init__(self, vm, path, _saved=None):
+        self.vm = vm
+        self.path = path
+        self._saved = {}  # page number -> encoded page as last written
+        self._length = None  # cell count in the last record
+
+        if _saved is None:
+            self._fp = open(path, "wb")
+            self._fp.write(
+                _CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION)
+            )
+        else:
+            self._fp = open(path, "ab")
+            self._saved = _saved
+            self._length = len(vm.memory)
+
+    def checkpoint(self):
+        vm = self.vm
+        memory = vm.memory
+        length = len(memory)
+        written = vm.take_journal()
+
+        if self._length is None or length < self._length:
+            # first record, or paged memory shrinking on reset()
+            candidates = self._all_pages()
+            for number in [n for n in self._saved if n << PAGE_BITS >= length]:
+                del self._saved[number]
+        else:
+            # negative addresses are the cells they alias
+            candidates = {
+                (address % length if address < 0 else address) >> PAGE_BITS
+                for address in written
+            }
+
+        self._length = length
+
+        pages = []
+        for number in sorted(candidates):
+            start = number << PAGE_BITS
+            if start >= length:
+                continue
+
+            data = _encode_page(memory[start : min(start + PAGE_SIZE, length)])
+            if self._saved.get(number) != data:
+                self._saved[number] = data
+                pages.append(_LENGTH.pack(number) + _blob(data))
+
+        record = b"".join(
+            [
+                _STATE.pack(vm.pointer, vm.halted, length),
+                _blob(_encode_values(vm.input if type(vm.input) is Queue else ())),
+                _blob(_encode_values(vm.output if type(vm.output) is Queue else ())),
+                _LENGTH.pack(len(pages)),
+                *pages,
+            ]
+        )
+        self._fp.write(_blob(record))
+        self._fp.flush()
+
+    def _all_pages(self):
+        memory = self.vm.memory
+
+        if isinstance(memory, PagedMemory):
+            # pages never allocated are zero, as restore() assumes
+            return set(memory._pages) | set(self._saved)
+
+        return set(range((len(memory) + PAGE_SIZE - 1) >> PAGE_BITS))
+
+    def close(self):
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _read_log(path):
+    # the state in the last complete record, with the encoded pages
+    with open(path, "rb") as fp:
+        data = fp.read()
+
+    if len(data) < _CHECKPOINT_HEADER.size:
+        raise ValueError(f"not an intcode checkpoint log: {path}")
+    magic, version = _CHECKPOINT_HEADER.unpack_from(data)
+    if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION:
+        raise ValueError(f"not a version {CHECKPOINT_VERSION} checkpoint log: {path}")
+
+    state = None
+    pages = {}
+    offset = _CHECKPOINT_HEADER.size
+
+    while offset + _LENGTH.size <= len(data):
+        (size,) = _LENGTH.unpack_from(data, offset)
+        start = offset + _LENGTH.size
+        if start + size > len(data):
+            break  # torn by a crash while it was being written
+
+        record = memoryview(data)[start : start + size]
+        offset = start + size
+
+        pointer, halted, length = _STATE.unpack_from(record)
+        position = _STATE.size
+        queues = []
+        for _ in range(2):
+            (count,) = _LENGTH.unpack_from(record, position)
+            position += _LENGTH.size
+            queues.append(_decode_values(bytes(record[position : position + count])))
+            position += count
+
+        (count,) = _LENGTH.unpack_from(record, position)
+        position += _LENGTH.size
+        for _ in range(count):
+            number, size = struct.unpack_from("<QQ", record, position)
+            position += 2 * _LENGTH.size
+            pages[number] = bytes(record[position : position + size])
+            position += size
+
+        for number in [n for n in pages if n << PAGE_BITS >= length]:
+            del pages[number]
+        state = (pointer, bool(halted), length, *queues)
+
+    if state is None:
+        raise ValueError(f"no complete checkpoint in {path}")
+
+    return state, pages
+
+
+def _restore(path, intcode_input, intcode_output, memory):
+    (pointer, halted, length, inputs, outputs), pages = _read_log(path)
+
+    cells = PagedMemory()
+    for number, data in pages.items():
+        start = number << PAGE_BITS
+        for offset, value in enumerate(_decode_page(data)[: max(length - start, 0)]):
+            if value:
+                cells[start + offset] = value
+    if length:
+        cells[length - 1] = cells[length - 1]
+
+    vm = IntcodeVM(
+        cells,
+        Queue(inputs) if intcode_input is None else intcode_input,
+        Queue(outputs) if intcode_output is None else intcode_output,
+        memory,
+    )
+    vm.pointer = pointer
+    vm.halted = halted
+
+    return vm, pages
+
+
+def restore(path, intcode_input=None, intcode_output=None, memory=list):
+    # a VM in the state of the last checkpoint in the log. Pending queue I/O
+    # comes back unless channels are given. Its image is the checkpoint, so
+    # reset() returns to it rather than to the original program.
+    return _restore(path, intcode_input, intcode_output, memory)[0]
+
+
+def run_with_checkpoints(vm, path, every=DEFAULT_EVERY):
+    # run() that starts a new log, checkpointing every `every` instructions
+    # and once more when the VM stops
+    with Checkpointer(vm, path) as checkpointer:
+        return _run(vm, checkpointer, every)
+
+
+def resume(
+    path, intcode_input=None, intcode_output=None, memory=list, every=DEFAULT_EVERY
+):
+    # carries on from the last checkpoint, appending to the same log, and
+    # returns the VM once it stops
+    vm, pages = _restore(path, intcode_input, intcode_output, memory)
+
+    with Checkpointer(vm, path, _saved=pages) as checkpointer:
+        _run(vm, checkpointer, every)
+
+    return vm
+
+
+def _run(vm, checkpointer, every):
+    checkpointer.checkpoint()
+
+    try:
+        for signal in vm.execute(every):
+            if signal is PAUSED:
+                checkpointer.checkpoint()
+            elif signal is NEEDS_INPUT:
+                raise ValueError("intcode input is empty")
+            else:
+                vm.output.send(signal)
+    finally:
+        vm.output.flush()
+        checkpointer.checkpoint()
+
+    return vm.memory
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "run.iccp")
+
+    def test_restore_matches_finished_run(self):
+        # countdown from 50 then output the counter
+        program = [1001, 10, -1, 10, 1005, 10, 0, 4, 10, 99, 50]
+        vm = IntcodeVM(program, Queue(), Queue())
+
+        memory = run_with_checkpoints(vm, self.path, every=7)
+        restored = restore(self.path)
+
+        self.assertEqual(memory, restored.memory)
+        self.assertTrue(restored.halted)
+        self.assertEqual([0], list(restored.output))
+
+    def test_resume_carries_on_from_a_checkpoint(self):
+        program = [1001, 10, -1, 10, 1005, 10, 0, 4, 10, 99, 50]
+        vm = IntcodeVM(program, Queue(), Queue())
+        with Checkpointer(vm, self.path) as checkpointer:
+            for _ in range(30):
+                vm.step()
+            checkpointer.checkpoint()
+
+        resumed = resume(self.path, every=5)
+
+        self.assertEqual(IntcodeVM(program, Queue(), Queue()).run(), resumed.memory)
+        self.assertEqual([0], list(resumed.output))
+
+    def test_pending_input_is_restored(self):
+        vm = IntcodeVM([3, 0, 3, 1, 4, 1, 99], Queue([7, 8]), Queue())
+        with Checkpointer(vm, self.path) as checkpointer:
+            vm.step()
+            checkpointer.checkpoint()
+
+        resumed = resume(self.path)
+
+        self.assertEqual([7, 8, 3, 1, 4, 1, 99], resumed.memory)
+        self.assertEqual([8], list(resumed.output))
+
+    def test_records_only_carry_changed_pages(self):
+        program = [1101, 1, 2, 3 * PAGE_SIZE, 99] + [0] * (4 * PAGE_SIZE)
+        vm = IntcodeVM(program, Queue(), Queue())
+
+        with Checkpointer(vm, self.path) as checkpointer:
+            checkpointer.checkpoint()
+            full = os.path.getsize(self.path)
+            vm.run()
+            checkpointer.checkpoint()
+            checkpointer.checkpoint()
+            incremental = os.path.getsize(self.path) - full
+
+        # one changed page against the four full pages of the first record
+        self.assertLess(incremental, full / 3)
+        self.assertEqual(3, restore(self.path).memory[3 * PAGE_SIZE])
+
+    def test_sparse_memory_is_checkpointed_sparsely(self):
+        vm = IntcodeVM([1101, 1, 2, 10 ** 9, 99], Queue(), Queue(), PagedMemory)
+
+        run_with_checkpoints(vm, self.path)
+        restored = restore(self.path, memory=PagedMemory)
+
+        self.assertLess(os.path.getsize(self.path), 3 * 8 * PAGE_SIZE)
+        self.assertEqual(3, restored.memory[10 ** 9])
+        self.assertEqual(10 ** 9 + 1, len(restored.memory))
+
+    def test_reset_between_checkpoints_is_recorded(self):
+        vm = IntcodeVM([1101, 1, 2, 0, 99], Queue(), Queue())
+        with Checkpointer(vm, self.path) as checkpointer:
+            vm.run()
+            checkpointer.checkpoint()
+            vm.reset()
+            checkpointer.checkpoint()
+
+        self.assertEqual([1101, 1, 2, 0, 99], restore(self.path).memory)
+
+    def test_checkpoint_only_looks_at_new_writes(self):
+        vm = IntcodeVM([99] + [0] * (3 * PAGE_SIZE), Queue(), Queue())
+        with Checkpointer(vm, self.path) as checkpointer:
+            vm.poke(PAGE_SIZE, 1)
+            checkpointer.checkpoint()
+            vm.poke(2 * PAGE_SIZE, 2)
+
+            self.assertEqual({2 * PAGE_SIZE}, vm.take_journal())
+            vm.poke(2 * PAGE_SIZE, 3)
+            checkpointer.checkpoint()
+            self.assertEqual(set(), vm.take_journal())
+
+        self.assertEqual(3, restore(self.path).memory[2 * PAGE_SIZE])
+
+    def test_negative_addresses_are_checkpointed_as_the_cells_they_alias(self):
+        program = [1, 5, 3, 1, 101, -1, 0, -3]
+        expected = IntcodeVM(program, Queue(), Queue()).run()
+
+        memory = run_with_checkpoints(
+            IntcodeVM(program, Queue(), Queue()), self.path, every=1
+        )
+
+        self.assertEqual(expected, memory)
+        self.assertEqual(expected, restore(self.path).memory)
+
+    def test_reset_restores_cells_taken_by_a_checkpoint(self):
+        vm = IntcodeVM([1101, 1, 2, 5, 99, 0], Queue(), Queue())
+        with Checkpointer(vm, self.path) as checkpointer:
+            vm.run()
+            checkpointer.checkpoint()
+            checkpointer.checkpoint()
+            vm.reset()
+            checkpointer.checkpoint()
+
+        self.assertEqual([1101, 1, 2, 5, 99, 0], vm.memory)
+        self.assertEqual([1101, 1, 2, 5, 99, 0], restore(self.path).memory)
+
+    def test_big_values_survive_a_checkpoint(self):
+        vm = IntcodeVM([1002, 5, 2 ** 40, 5, 99, 2 ** 40], Queue(), Queue())
+
+        run_with_checkpoints(vm, self.path)
+
+        self.assertEqual(2 ** 80, restore(self.path).memory[5])
+
+    def test_torn_record_is_ignored(self):
+        vm = IntcodeVM([1101, 1, 2, 0, 99], Queue(), Queue())
+        run_with_checkpoints(vm, self.path)
+        with open(self.path, "ab") as fp:
+            fp.write(_LENGTH.pack(100) + b"partial")
+
+        self.assertEqual(3, restore(self.path).memory[0])
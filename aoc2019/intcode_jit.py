@@ -0,0 +1,578 @@
+import hashlib
+import unittest
+from intcode import (
+    ADDITION,
+    EQUALS,
+    HALT,
+    INPUT,
+    JUMP_IF_FALSE,
+    JUMP_IF_TRUE,
+    LESS_THAN,
+    MULTIPLICATION,
+    OUTPUT,
+    WIDTHS,
+    IntcodeVM,
+    Queue,
+    decode,
+)
+
+_OPERATORS = {ADDITION: "+", MULTIPLICATION: "*", LESS_THAN: "<", EQUALS: "=="}
+_BLOCKS = {}  # generated block source -> function
+_MAX_RECOMPILES = 8  # after this many invalidations a block is interpreted
+
+
+class BlockVM(IntcodeVM):
+    # compiles straight-line runs of instructions into one Python function per
+    # basic block, dropping a block whenever something writes into its code
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._blocks = {}  # start -> (function, write targets, end)
+        self._owners = {}  # code address -> starts of the blocks it belongs to
+        # start -> times its block was dropped by writes during this run
+        self._invalidations = {}
+
+    def reset(self):
+        self._invalidate(self._written(), counted=False)
+        self._invalidations.clear()
+        super().reset()
+
+    def run(self):
+        memory = self._promote()
+        blocks = self._blocks
+        owners = self._owners
+        ip = self.pointer
+
+        # writes made outside of run(), by step(), execute() or poke(); they
+        # are not the block rewriting itself, so they do not count
+        self._invalidate(self._written(), counted=False)
+
+        while not self.halted and ip < len(memory):
+            try:
+                block, writes, _ = blocks[ip]
+            except KeyError:
+                block, writes, _ = self._compile(ip)
+
+            if block is None:
+                # the interpreter's write is in no block's write list
+                target = self._write_target(ip)
+                self.step()
+                self._invalidate(target)
+                ip = self.pointer
+                continue
+
+            ip = self.pointer = block(memory, self)
+
+            for address in writes:
+                if address in owners:
+                    self._invalidate(writes)
+                    break
+
+        self.output.flush()
+        return memory
+
+    def _invalidate(self, addresses, counted=True):
+        owners = self._owners
+        size = len(self.memory)
+        # every block to drop, found before dropping any of them changes
+        # owners; negative addresses are the cells they alias
+        starts = set().union(
+            *(owners.get(address % size if address < 0 else address, ())
+              for address in addresses)
+        )
+
+        for start in starts:
+            _, _, end = self._blocks.pop(start)
+            if counted:
+                self._invalidations[start] = self._invalidations.get(start, 0) + 1
+
+            for code_address in range(start, end):
+                owners[code_address].discard(start)
+                if not owners[code_address]:
+                    del owners[code_address]
+
+    def _write_target(self, ip):
+        memory = self.memory
+
+        try:
+            opcode = decode(memory[ip])[0]
+            if opcode in _OPERATORS:
+                return (memory[ip + 3],)
+            elif opcode == INPUT:
+                return (memory[ip + 1],)
+        except (ValueError, IndexError):
+            pass
+
+        return ()
+
+    def _compile(self, start):
+        if start < 0:
+            # runs the code at the cell it aliases, which owners never see
+            return None, (), start
+        if self._invalidations.get(start, 0) >= _MAX_RECOMPILES:
+            return None, (), start  # keeps rewriting itself, so interpret it
+
+        memory = self.memory
+        lines = []
+        writes = []
+        pc = start
+        loops = False
+
+        def operand(offset, mode):
+            value = memory[pc + offset]
+            return repr(value) if mode else f"memory[{value}]"
+
+        def writes_code(end):
+            return any(start <= target < end for target in writes)
+
+        while pc < len(memory):
+            try:
+                opcode, mode_a, mode_b = decode(memory[pc])
+            except ValueError:
+                break
+
+            width = WIDTHS[opcode]
+            if pc + width > len(memory):
+                break
+            if any(pc <= target < pc + width for target in writes):
+                break  # an earlier instruction in this block rewrites this one
+            if opcode in _OPERATORS or opcode == INPUT:
+                target = memory[pc + width - 1]
+                if not 0 <= target < len(memory):
+                    break  # negative targets can alias code, so step() does them
+
+            if opcode in _OPERATORS:
+                a, b, target = operand(1, mode_a), operand(2, mode_b), memory[pc + 3]
+                if opcode in (LESS_THAN, EQUALS):
+                    expression = f"1 if {a} {_OPERATORS[opcode]} {b} else 0"
+                else:
+                    expression = f"{a} {_OPERATORS[opcode]} {b}"
+
+                lines.append(f"memory[{target}] = {expression}")
+                writes.append(target)
+            elif opcode == INPUT:
+                target = memory[pc + 1]
+                lines.append("value = vm.input.receive()")
+                lines.append("if value is None:")
+                lines.append(f"    vm.pointer = {pc}")
+                lines.append("    raise ValueError('intcode input is empty')")
+                lines.append(f"memory[{target}] = value")
+                writes.append(target)
+            elif opcode == OUTPUT:
+                lines.append(f"vm.output.send({operand(1, mode_a)})")
+            elif opcode in (JUMP_IF_TRUE, JUMP_IF_FALSE):
+                comparison = "!=" if opcode == JUMP_IF_TRUE else "=="
+                predicate = f"{operand(1, mode_a)} {comparison} 0"
+                destination = operand(2, mode_b)
+
+                if mode_b and memory[pc + 2] == start and not writes_code(pc + 3):
+                    # a tight loop back to this block stays inside the function
+                    lines.append(f"if {predicate}:")
+                    lines.append("    continue")
+                    lines.append(f"return {pc + 3}")
+                    loops = True
+                else:
+                    lines.append(f"return {destination} if {predicate} else {pc + 3}")
+            else:
+                lines.append("vm.halted = True")
+                lines.append(f"return {pc}")
+
+            pc += width
+            if opcode in (JUMP_IF_TRUE, JUMP_IF_FALSE, HALT):
+                break
+
+        if not lines:
+            # nothing compilable here, let the interpreter raise the error
+            return None, (), start
+        if not lines[-1].startswith("return"):
+            lines.append(f"return {pc}")
+        if loops:
+            lines = ["while True:"] + [f"    {line}" for line in lines]
+        if writes:
+            # journalled up front so an exception part way still resets cleanly
+            lines.insert(0, f"vm._dirty.update({tuple(sorted(set(writes)))!r})")
+
+        source = "".join(f"    {line}\n" for line in lines)
+        try:
+            function = _BLOCKS[source]
+        except KeyError:
+            # code that flips between a few shapes only pays for exec once each
+            namespace = {}
+            exec(f"def block(memory, vm):\n{source}", namespace)
+            function = _BLOCKS[source] = namespace["block"]
+
+        compiled = (function, tuple(set(writes)), pc)
+        self._blocks[start] = compiled
+        for address in range(start, pc):
+            self._owners.setdefault(address, set()).add(start)
+
+        return compiled
+
+
+_TRANSPILED = {}  # digest of the reachable code -> generated function, or None
+
+
+def _digest(size, start, instructions):
+    # the generated code only depends on the instructions reachable from
+    # start and the memory size, so data cells never need hashing and the
+    # cache holds no copy of any program
+    code = repr((size, start, sorted(instructions.items()))).encode()
+
+    return hashlib.blake2b(code, digest_size=16).digest()
+
+
+def transpile(memory, start=0):
+    # whole program as one function: a match on pc per basic block, every
+    # memory cell the code addresses held in a local, and I/O inlined.
+    # Programs that write into their own code get None and stay interpreted.
+    instructions, leaders = _discover(memory, start)
+    size = len(memory)
+    key = _digest(size, start, instructions)
+
+    try:
+        return _TRANSPILED[key]
+    except KeyError:
+        pass
+
+    code = set()
+    addresses = set()
+    writes = set()
+
+    for pc, (opcode, mode_a, mode_b, args) in instructions.items():
+        code.update(range(pc, pc + WIDTHS[opcode]))
+        reads = args[:-1] if opcode in _OPERATORS or opcode == INPUT else args
+        positional = [arg for arg, mode in zip(reads, (mode_a, mode_b)) if not mode]
+        if len(reads) < len(args):
+            positional.append(args[-1])  # write targets ignore their mode
+
+        if any(not -size <= address < size for address in positional):
+            _TRANSPILED[key] = None
+            return None
+
+        addresses.update(address % size for address in positional)
+        if opcode in _OPERATORS or opcode == INPUT:
+            writes.add(args[-1] % size)
+
+    if writes & code:
+        _TRANSPILED[key] = None
+        return None
+
+    def operand(arg, mode):
+        return repr(arg) if mode else f"m{arg % size}"
+
+    lines = [
+        "def program(memory, vm):",
+        "    receive = vm.input.receive",
+        "    send = vm.output.send",
+    ]
+    lines += [f"    m{address} = memory[{address}]" for address in sorted(addresses)]
+    lines += [f"    pc = {start}", "    halted = False", "    try:", "        while True:"]
+    lines.append("            match pc:")
+
+    for leader in sorted(leaders):
+        if leader not in instructions:
+            continue
+
+        lines.append(f"                case {leader}:")
+        pc = leader
+
+        while True:
+            if pc not in instructions:
+                lines.append(f"                    pc = {pc}")
+                break
+
+            opcode, mode_a, mode_b, args = instructions[pc]
+            body = []
+
+            if opcode in _OPERATORS:
+                a, b = operand(args[0], mode_a), operand(args[1], mode_b)
+                target = f"m{args[2] % size}"
+                if opcode in (LESS_THAN, EQUALS):
+                    operator = _OPERATORS[opcode]
+                    body.append(f"{target} = 1 if {a} {operator} {b} else 0")
+                else:
+                    body.append(f"{target} = {a} {_OPERATORS[opcode]} {b}")
+            elif opcode == INPUT:
+                body += [
+                    "value = receive()",
+                    "if value is None:",
+                    f"    vm.pointer = {pc}",
+                    "    raise ValueError('intcode input is empty')",
+                    f"m{args[0] % size} = value",
+                ]
+            elif opcode == OUTPUT:
+                body.append(f"send({operand(args[0], mode_a)})")
+            elif opcode in (JUMP_IF_TRUE, JUMP_IF_FALSE):
+                comparison = "!=" if opcode == JUMP_IF_TRUE else "=="
+                predicate = f"{operand(args[0], mode_a)} {comparison} 0"
+                destination = operand(args[1], mode_b)
+                body.append(f"pc = {destination} if {predicate} else {pc + 3}")
+            else:
+                body += [f"pc = {pc}", "halted = True", "break"]
+
+            lines += [f"                    {line}" for line in body]
+            if opcode in (JUMP_IF_TRUE, JUMP_IF_FALSE, HALT):
+                break
+
+            pc += WIDTHS[opcode]
+            if pc in leaders:
+                lines.append(f"                    pc = {pc}")
+                break
+
+    lines += ["                case _:", "                    break", "    finally:"]
+    lines += [f"        memory[{address}] = m{address}" for address in sorted(writes)]
+    lines.append(f"        vm._dirty.update({tuple(sorted(writes))!r})")
+    lines.append("    return pc, halted")
+
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    _TRANSPILED[key] = namespace["program"]
+
+    return namespace["program"]
+
+
+def _discover(memory, start):
+    # every instruction reachable from start, plus the pcs that begin a block
+    instructions = {}
+    leaders = {start}
+    pending = [start]
+
+    while pending:
+        pc = pending.pop()
+
+        while 0 <= pc < len(memory):
+            if pc in instructions:
+                leaders.add(pc)
+                break
+
+            try:
+                opcode, mode_a, mode_b = decode(memory[pc])
+            except ValueError:
+                break
+
+            width = WIDTHS[opcode]
+            if pc + width > len(memory):
+                break
+
+            args = list(memory[pc + 1 : pc + width])
+            instructions[pc] = (opcode, mode_a, mode_b, args)
+
+            if opcode == HALT:
+                break
+            elif opcode in (JUMP_IF_TRUE, JUMP_IF_FALSE):
+                leaders.add(pc + 3)
+                pending.append(pc + 3)
+                if mode_b:
+                    leaders.add(args[1])
+                    pending.append(args[1])
+                break
+
+            pc += width
+
+    return instructions, leaders
+
+
+class TranspiledVM(IntcodeVM):
+    # runs the transpiled program where possible and hands over to the
+    # interpreter wherever it stops: a jump to an address it does not know,
+    # a bad instruction, or a program that rewrites its own code
+    def run(self):
+        memory = self._promote()
+
+        if not self.halted:
+            program = transpile(memory, self.pointer)
+            if program is not None:
+                self.pointer, self.halted = program(memory, self)
+
+        return super().run()
+
+
+DIAGNOSTIC = [
+    int(x)
+    for x in (
+        "3,21,1008,21,8,20,1005,20,22,107,8,21,20,1006,20,31,1106,0,36,98,0,0,"
+        "1002,21,125,20,4,20,1105,1,46,104,999,1105,1,46,1101,1000,1,20,4,20,"
+        "1105,1,46,98,99"
+    ).split(",")
+]
+
+
+PROGRAMS = [
+    ([99], []),
+    ([1, 0, 0, 0, 99], []),
+    ([4, 0], []),
+    ([1, 1, 1, 4, 99, 5, 6, 0, 99], []),
+    ([1002, 4, 3, 4, 33], []),
+    ([1101, 9, 0, 0, 105, 1, 0, 1998, 819, 99], []),
+    ([3, 9, 8, 9, 10, 9, 4, 9, 99, -1, 8], [8]),
+    ([3, 3, 1105, -1, 9, 1101, 0, 0, 12, 4, 12, 99, 1], [0]),
+    ([1001, 8, -1, 8, 1005, 8, 0, 99, 50], []),
+    # jumps to -2, then rewrites the code there and jumps back to it
+    (
+        [3, 1, 4, -3, 1005, 5, -2, 99, 1101, 3, -1, 16, 2, 5, 18, 14, 99, 4, -1],
+        [-2, 26, 2, 15, 15],
+    ),
+] + [(DIAGNOSTIC, [value]) for value in (5, 8, 15)]
+
+
+def _interpreted(program, inputs=()):
+    return _compiled(program, inputs, IntcodeVM)
+
+
+def _compiled(program, inputs=(), engine=None):
+    # final memory, outputs and the error the run stopped with, if any
+    vm = (engine or BlockVM)(program, Queue(inputs), Queue())
+
+    try:
+        vm.run()
+    except (ValueError, IndexError) as error:
+        return vm.memory, list(vm.output), repr(error)
+
+    return vm.memory, list(vm.output), None
+
+
+class Test(unittest.TestCase):
+    def test_matches_interpreter(self):
+        for program, inputs in PROGRAMS:
+            self.assertEqual(
+                _interpreted(program, inputs), _compiled(program, inputs), program
+            )
+
+    def test_transpiled_matches_interpreter(self):
+        for program, inputs in PROGRAMS:
+            self.assertEqual(
+                _interpreted(program, inputs),
+                _compiled(program, inputs, TranspiledVM),
+                program,
+            )
+
+    def test_self_modifying_programs_are_not_transpiled(self):
+        self.assertIsNone(transpile([1, 1, 1, 4, 99, 5, 6, 0, 99]))
+        self.assertIsNone(transpile([1101, 9, 0, 0, 105, 1, 0, 1998, 819, 99]))
+
+    def test_transpile_is_cached_by_program(self):
+        program = [1001, 8, -1, 8, 1005, 8, 0, 99, 50]
+
+        self.assertIsNotNone(transpile(program))
+        self.assertIs(transpile(program), transpile(list(program)))
+
+    def test_immediate_mode_input_target_is_loaded(self):
+        # the input at 3 is never run, but its target is still written back
+        program = [5, 2, 8, 103, 11, 199, 1004, 7, 99, 99, 104, 8, 1004, 4]
+        program += [1105, 10, 15]
+
+        self.assertEqual(_interpreted(program), _compiled(program, (), TranspiledVM))
+
+    def test_transpile_cache_is_keyed_on_reachable_code(self):
+        # the counter at 8 is data, so only the step size changes the code
+        program = [1001, 8, -1, 8, 1005, 8, 0, 99, 50]
+        other_counter = program[:-1] + [7]
+        other_step = [1001, 8, -2, 8, 1005, 8, 0, 99, 50]
+
+        self.assertIs(transpile(program), transpile(other_counter))
+        self.assertIsNot(transpile(program), transpile(other_step))
+        self.assertEqual(
+            _interpreted(other_counter), _compiled(other_counter, (), TranspiledVM)
+        )
+
+    def test_unknown_jump_target_falls_back_to_interpreter(self):
+        program = [6, 10, 11, 99, 104, 7, 99, 0, 0, 0, 0, 4]
+
+        self.assertIsNotNone(transpile(program))
+        self.assertEqual(_interpreted(program), _compiled(program, (), TranspiledVM))
+
+    def test_transpiled_missing_input_can_resume(self):
+        vm = TranspiledVM([1101, 1, 1, 7, 3, 8, 99, 0, 0], Queue())
+
+        with self.assertRaises(ValueError):
+            vm.run()
+
+        self.assertEqual(4, vm.pointer)
+        self.assertEqual(2, vm.memory[7])
+        vm.input.send(5)
+        self.assertEqual([1101, 1, 1, 7, 3, 8, 99, 2, 5], vm.run())
+
+    def test_tight_loop_runs_inside_one_block(self):
+        vm = BlockVM([1001, 8, -1, 8, 1005, 8, 0, 99, 50])
+
+        vm.run()
+
+        self.assertEqual({0, 7}, set(vm._blocks))
+        self.assertEqual(0, vm.memory[8])
+
+    def test_block_is_recompiled_after_its_code_changes(self):
+        # the first pass turns the add at 0 into a multiply, then loops once
+        program = [1, 20, 21, 20, 1101, 0, 2, 0, 1005, 23, 18, 1101, 0, 1, 23]
+        program += [1105, 1, 0, 99, 0, 3, 5, 0, 0]
+        vm = BlockVM(program)
+
+        vm.run()
+
+        self.assertEqual(40, vm.memory[20])
+        self.assertEqual(IntcodeVM(program).run(), vm.memory)
+
+    def test_block_that_keeps_changing_is_interpreted(self):
+        # the instruction at 0 flips between add and multiply every pass
+        program = [1, 20, 21, 20, 1002, 0, -1, 0, 1001, 0, 3, 0, 1001, 22, -1, 22]
+        program += [1005, 22, 0, 99, 0, 1, 50]
+        vm = BlockVM(program)
+
+        vm.run()
+
+        self.assertNotIn(0, vm._blocks)
+        self.assertEqual(IntcodeVM(program).run(), vm.memory)
+
+    def test_reset_forgets_how_often_blocks_were_dropped(self):
+        # day 2 style: the first instruction writes the cell at 3 every run
+        program = [1, 9, 10, 3, 2, 3, 11, 0, 99, 30, 40, 50]
+        vm = BlockVM(program)
+
+        for _ in range(2 * _MAX_RECOMPILES):
+            vm.run()
+            vm.reset()
+
+        self.assertIsNotNone(vm._compile(0)[0])
+        self.assertEqual(IntcodeVM(program).run(), vm.run())
+
+    def test_block_writing_two_of_its_own_cells_is_dropped_once(self):
+        program = [1101, 5, 6, 1, 1101, 7, 8, 2, 99]
+        vm = BlockVM(program)
+
+        self.assertEqual(_interpreted(program), _compiled(program))
+        vm.run()
+        vm.reset()
+        self.assertEqual(IntcodeVM(program).run(), vm.run())
+
+    def test_negative_write_target_is_checked_against_code(self):
+        # memory[-1] aliases the write target of the next instruction
+        program = [1102, 3, -1, -1, 101, 7, 5, 1]
+
+        self.assertEqual(_interpreted(program), _compiled(program))
+
+    def test_interpreted_writes_drop_compiled_blocks(self):
+        # the block at 0 is interpreted after enough rewrites, and keeps
+        # rewriting the output instruction's operand in the block at 8
+        program = [1101, 100, 0, 9, 1001, 1, 1, 1, 104, 0, 1001, 20, -1, 20]
+        program += [1005, 20, 0, 99, 0, 0, 12]
+
+        self.assertEqual(_interpreted(program), _compiled(program))
+
+    def test_reset_drops_blocks_for_restored_code(self):
+        program = [1101, 0, 99, 7, 1105, 1, 7, 1, 0, 0, 0, 99]
+        vm = BlockVM(program)
+
+        vm.run()
+        self.assertIn(7, vm._owners)
+        vm.reset()
+
+        self.assertNotIn(7, vm._owners)
+        self.assertEqual(IntcodeVM(program).run(), vm.run())
+
+    def test_missing_input_leaves_pointer_on_the_instruction(self):
+        vm = BlockVM([1101, 1, 1, 0, 3, 0, 99], Queue())
+
+        with self.assertRaises(ValueError):
+            vm.run()
+
+        self.assertEqual(4, vm.pointer)
+        vm.input.send(5)
+        self.assertEqual([5, 1, 1, 0, 3, 0, 99], vm.run())
@@ -0,0 +1,298 @@
+import unittest
+from collections import deque
+from intcode import (
+    ADDITION,
+    EQUALS,
+    HALT,
+    INPUT,
+    JUMP_IF_FALSE,
+    JUMP_IF_TRUE,
+    LESS_THAN,
+    MULTIPLICATION,
+    OUTPUT,
+    WIDTHS,
+    IntcodeVM,
+    Queue,
+    decode,
+    run_batch,
+)
+
+try:
+    import numpy as np
+except ImportError:  # optional, only LockstepVM needs it
+    np = None
+
+# products at or past this are treated as overflowing int64; the float
+# estimate is rough, so lanes near the limit go back to IntcodeVM
+_PRODUCT_LIMIT = 2.0 ** 62
+
+
+class LockstepVM:
+    # many copies of one program stepped together, one row of an int64 array
+    # per lane. Each sweep steps every running lane once, grouping lanes by
+    # (pointer, instruction) so each group is a few fancy-indexed array ops.
+    # Cells are int64 and do not promote: a lane whose arithmetic would
+    # overflow, or that hits a bad instruction or address, stops with its
+    # error in `errors` instead of stopping the others.
+    def __init__(self, program, lanes, inputs=None):
+        if np is None:
+            raise ImportError("LockstepVM needs numpy")
+
+        self.memory = np.asfortranarray(
+            np.tile(np.asarray(program, dtype=np.int64), (lanes, 1))
+        )
+        self.pointer = np.zeros(lanes, dtype=np.int64)
+        self.halted = np.zeros(lanes, dtype=bool)
+        self.inputs = [deque(values) for values in inputs or [()] * lanes]
+        self.outputs = [[] for _ in range(lanes)]
+        self.errors = {}  # lane -> exception that stopped it
+
+    def poke(self, address, values):
+        # one value per lane, or one for all of them
+        self.memory[:, address] = values
+
+    def peek(self, address):
+        return self.memory[:, address].tolist()
+
+    def run(self):
+        memory = self.memory
+        width = memory.shape[1]
+
+        while True:
+            active = np.flatnonzero(~self.halted)
+            pointers = self.pointer[active]
+
+            running = (pointers >= 0) & (pointers < width)
+            if not running.all():
+                self.halted[active[pointers >= width]] = True
+                negative = active[pointers < 0]
+                self._fault(negative, IndexError("intcode pointer is negative"))
+                active = active[running]
+                pointers = pointers[running]
+            if not active.size:
+                break
+
+            words = memory[active, pointers]
+            if (pointers == pointers[0]).all() and (words == words[0]).all():
+                # every lane is at the same instruction, so no grouping
+                self._step(active, int(pointers[0]), int(words[0]))
+                continue
+
+            order = np.lexsort((words, pointers))
+            active, pointers, words = active[order], pointers[order], words[order]
+            changes = (np.diff(pointers) != 0) | (np.diff(words) != 0)
+            bounds = [0, *(np.flatnonzero(changes) + 1).tolist(), len(active)]
+
+            for start, end in zip(bounds, bounds[1:]):
+                self._step(active[start:end], int(pointers[start]), int(words[start]))
+
+        return memory
+
+    def _fault(self, lanes, error):
+        if not lanes.size:
+            return
+
+        for lane in lanes.tolist():
+            self.errors[lane] = error
+        self.halted[lanes] = True
+
+    def _address(self, lanes, address, ok):
+        # the address parameter of each lane, clearing ok where it is out of
+        # range (negative addresses count from the end, as with a list)
+        width = self.memory.shape[1]
+        parameter = self.memory[lanes, address]
+        ok &= (parameter >= -width) & (parameter < width)
+
+        return np.where(ok, parameter, 0)
+
+    def _read(self, lanes, address, mode, ok):
+        if mode:
+            return self.memory[lanes, address]
+
+        return self.memory[lanes, self._address(lanes, address, ok)]
+
+    def _step(self, lanes, pc, word):
+        memory = self.memory
+
+        try:
+            opcode, mode_a, mode_b = decode(word)
+            if pc + WIDTHS[opcode] > memory.shape[1]:
+                raise IndexError("intcode instruction runs past the end of memory")
+        except (ValueError, IndexError) as error:
+            self._fault(lanes, error)
+            return
+
+        if opcode == HALT:
+            self.halted[lanes] = True
+            return
+
+        ok = np.ones(len(lanes), dtype=bool)
+
+        if opcode == INPUT:
+            targets = self._address(lanes, pc + 1, ok)
+            for lane, target, good in zip(lanes.tolist(), targets.tolist(), ok):
+                values = self.inputs[lane]
+                try:
+                    if not good:
+                        raise IndexError("intcode address out of range")
+                    if not values:
+                        raise ValueError("intcode input is empty")
+                    memory[lane, target] = values[0]
+                except (ValueError, IndexError, OverflowError) as error:
+                    self._fault(np.array([lane]), error)
+                    continue
+
+                values.popleft()
+                self.pointer[lane] = pc + 2
+            return
+
+        a = self._read(lanes, pc + 1, mode_a, ok)
+
+        if opcode == OUTPUT:
+            for lane, value, good in zip(lanes.tolist(), a.tolist(), ok):
+                if good:
+                    self.outputs[lane].append(value)
+            self._fault(lanes[~ok], IndexError("intcode address out of range"))
+            self.pointer[lanes[ok]] = pc + 2
+            return
+
+        if opcode in (JUMP_IF_TRUE, JUMP_IF_FALSE):
+            jump = ok & ((a != 0) if opcode == JUMP_IF_TRUE else (a == 0))
+            # as in IntcodeVM, only lanes that jump read the destination
+            taken = lanes[jump]
+            good = np.ones(len(taken), dtype=bool)
+            destination = self._read(taken, pc + 2, mode_b, good)
+            self._fault(lanes[~ok], IndexError("intcode address out of range"))
+            self._fault(taken[~good], IndexError("intcode address out of range"))
+            self.pointer[taken[good]] = destination[good]
+            self.pointer[lanes[ok & ~jump]] = pc + 3
+            return
+
+        b = self._read(lanes, pc + 2, mode_b, ok)
+
+        targets = self._address(lanes, pc + 3, ok)
+        if not ok.all():
+            self._fault(lanes[~ok], IndexError("intcode address out of range"))
+
+        if opcode == ADDITION:
+            result = a + b
+            # wrapped iff both operands have the sign the sum does not
+            overflow = ((a ^ result) & (b ^ result)) < 0
+        elif opcode == MULTIPLICATION:
+            result = a * b
+            overflow = np.abs(a.astype(np.float64) * b) >= _PRODUCT_LIMIT
+        elif opcode == LESS_THAN:
+            result = (a < b).astype(np.int64)
+            overflow = None
+        elif opcode == EQUALS:
+            result = (a == b).astype(np.int64)
+            overflow = None
+
+        if overflow is not None and overflow.any():
+            self._fault(lanes[ok & overflow], OverflowError("int64 cell overflowed"))
+            ok &= ~overflow
+
+        if not ok.all():
+            lanes, targets, result = lanes[ok], targets[ok], result[ok]
+        memory[lanes, targets] = result
+        self.pointer[lanes] = pc + 4
+
+
+def run_batch_lockstep(program, inputs):
+    # run_batch with every input sequence as one lane of a LockstepVM. Lanes
+    # that stop on an error are rerun on IntcodeVM, so results and errors
+    # are the same as run_batch gives.
+    inputs = [list(values) for values in inputs]
+    vm = LockstepVM(program, len(inputs), inputs)
+    vm.run()
+
+    for index, values in enumerate(inputs):
+        if index in vm.errors:
+            fallback = IntcodeVM(program, Queue(values), Queue())
+            fallback.run()
+            yield index, list(fallback.output)
+        else:
+            yield index, vm.outputs[index]
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class Test(unittest.TestCase):
+    def test_lanes_run_the_same_program_on_different_inputs(self):
+        program = [3, 10, 1, 9, 10, 9, 4, 9, 99, 5, 0]
+
+        vm = LockstepVM(program, 3, [[1], [2], [3]])
+        vm.run()
+
+        self.assertEqual([[6], [7], [8]], vm.outputs)
+        self.assertEqual([6, 7, 8], vm.peek(9))
+
+    def test_diverging_lanes_match_run_batch(self):
+        # outputs 999, 1000 or 1001 as the input is below, at or above 8
+        program = [
+            int(x)
+            for x in (
+                "3,21,1008,21,8,20,1005,20,22,107,8,21,20,1006,20,31,1106,0,36,98,0,0,"
+                "1002,21,125,20,4,20,1105,1,46,104,999,1105,1,46,1101,1000,1,20,4,20,"
+                "1105,1,46,98,99"
+            ).split(",")
+        ]
+        inputs = [[value] for value in range(5, 12)]
+
+        self.assertEqual(
+            list(run_batch(program, inputs)),
+            list(run_batch_lockstep(program, inputs)),
+        )
+
+    def test_lanes_step_different_loop_counts(self):
+        # count down from the input, outputting the number of iterations
+        program = [3, 17, 1001, 17, -1, 17, 1001, 18, 1, 18, 1005, 17, 2, 4, 18, 99]
+        program += [0, 0, 0]
+
+        vm = LockstepVM(program, 3, [[1], [10], [100]])
+        vm.run()
+
+        self.assertEqual([[1], [10], [100]], vm.outputs)
+
+    def test_jump_not_taken_does_not_read_its_destination(self):
+        # the destination is at -1 in position mode, out of range for a list
+        program = [106, 2, 8, 1106, 5, -1, 99]
+
+        vm = LockstepVM(program, 2)
+        vm.run()
+
+        self.assertEqual({}, vm.errors)
+        self.assertTrue(vm.halted.all())
+
+    def test_poke_sets_a_cell_in_every_lane(self):
+        vm = LockstepVM([1, 0, 0, 0, 99], 2)
+        vm.poke(1, [0, 4])
+
+        vm.run()
+
+        self.assertEqual([2, 100], vm.peek(0))
+
+    def test_overflow_stops_only_that_lane(self):
+        program = [3, 9, 1002, 9, 2 ** 40, 9, 4, 9, 99, 0]
+
+        vm = LockstepVM(program, 2, [[1], [2 ** 30]])
+        vm.run()
+
+        self.assertEqual([[2 ** 40], []], vm.outputs)
+        self.assertIsInstance(vm.errors[1], OverflowError)
+
+    def test_run_batch_lockstep_reruns_overflowing_lanes(self):
+        program = [3, 9, 1002, 9, 2 ** 40, 9, 4, 9, 99, 0]
+
+        results = list(run_batch_lockstep(program, [[1], [2 ** 30]]))
+
+        self.assertEqual([(0, [2 ** 40]), (1, [2 ** 70])], results)
+
+    def test_bad_instruction_stops_only_that_lane(self):
+        # jumps to the input, which is 99 for one lane and garbage for another
+        program = [3, 5, 1105, 1, 5, 0]
+
+        vm = LockstepVM(program, 2, [[99], [98]])
+        vm.run()
+
+        self.assertNotIn(0, vm.errors)
+        self.assertIsInstance(vm.errors[1], ValueError)
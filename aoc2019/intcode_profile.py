@@ -0,0 +1,159 @@
+import json
+import sys
+import unittest
+from collections import Counter
+from intcode import (
+    ADDITION,
+    EQUALS,
+    HALT,
+    INPUT,
+    JUMP_IF_FALSE,
+    JUMP_IF_TRUE,
+    LESS_THAN,
+    MULTIPLICATION,
+    OUTPUT,
+    IntcodeVM,
+    decode,
+)
+
+NAMES = {
+    ADDITION: "ADDITION",
+    MULTIPLICATION: "MULTIPLICATION",
+    INPUT: "INPUT",
+    OUTPUT: "OUTPUT",
+    JUMP_IF_TRUE: "JUMP_IF_TRUE",
+    JUMP_IF_FALSE: "JUMP_IF_FALSE",
+    LESS_THAN: "LESS_THAN",
+    EQUALS: "EQUALS",
+    HALT: "HALT",
+}
+READS = {  # how many leading parameters each opcode reads
+    ADDITION: 2,
+    MULTIPLICATION: 2,
+    INPUT: 0,
+    OUTPUT: 1,
+    JUMP_IF_TRUE: 2,
+    JUMP_IF_FALSE: 2,
+    LESS_THAN: 2,
+    EQUALS: 2,
+    HALT: 0,
+}
+WRITES = {ADDITION: 3, MULTIPLICATION: 3, INPUT: 1, LESS_THAN: 3, EQUALS: 3}
+
+
+class Profile:
+    def __init__(self):
+        self.steps = 0
+        self.opcodes = Counter()
+        self.addresses = Counter()  # executions per instruction address
+        self.branches = {}  # jump address -> [taken, not taken]
+        self.reads = Counter()  # positional reads per memory address
+        self.writes = Counter()
+
+    def to_dict(self):
+        return {
+            "steps": self.steps,
+            "opcodes": dict(self.opcodes),
+            "addresses": {str(k): v for k, v in sorted(self.addresses.items())},
+            "branches": {str(k): v for k, v in sorted(self.branches.items())},
+            "reads": {str(k): v for k, v in sorted(self.reads.items())},
+            "writes": {str(k): v for k, v in sorted(self.writes.items())},
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def report(self, top=10):
+        lines = [f"{self.steps} steps", "", "opcodes:"]
+        for name, count in self.opcodes.most_common():
+            lines.append(f"  {name:<15} {count:>12} {count / self.steps:7.1%}")
+
+        lines += ["", f"hottest addresses (top {top}):"]
+        for address, count in self.addresses.most_common(top):
+            lines.append(f"  {address:>8} {count:>12}")
+
+        lines += ["", "branches (taken / not taken):"]
+        for address, (taken, not_taken) in sorted(self.branches.items()):
+            ratio = taken / (taken + not_taken)
+            lines.append(f"  {address:>8} {taken:>12} {not_taken:>12} {ratio:7.1%}")
+
+        for title, heatmap in (("reads", self.reads), ("writes", self.writes)):
+            lines += ["", f"most {title} (top {top}):"]
+            for address, count in heatmap.most_common(top):
+                lines.append(f"  {address:>8} {count:>12}")
+
+        return "\n".join(lines)
+
+
+def profile(vm):
+    # runs the VM one step at a time, recording as it goes; run() itself is
+    # left untouched so there is no cost when profiling is off
+    result = Profile()
+
+    while not vm.halted and vm.pointer < len(vm.memory):
+        memory = vm.memory
+        ip = vm.pointer
+        opcode, mode_a, mode_b = decode(memory[ip])
+
+        result.steps += 1
+        result.opcodes[NAMES[opcode]] += 1
+        result.addresses[ip] += 1
+        for offset, mode in ((1, mode_a), (2, mode_b))[: READS[opcode]]:
+            if not mode:
+                result.reads[memory[ip + offset]] += 1
+        if opcode in WRITES:
+            result.writes[memory[ip + WRITES[opcode]]] += 1
+
+        vm.step()
+
+        if opcode in (JUMP_IF_TRUE, JUMP_IF_FALSE):
+            branch = result.branches.setdefault(ip, [0, 0])
+            branch[0 if vm.pointer != ip + 3 else 1] += 1
+
+    vm.output.flush()
+    return result
+
+
+def profile_intcode(intcode, intcode_input=sys.stdin, intcode_output=sys.stdout):
+    # process_intcode, also returning the profile of the run
+    vm = IntcodeVM(intcode, intcode_input, intcode_output)
+    result = profile(vm)
+
+    return vm.memory, result
+
+
+class Test(unittest.TestCase):
+    def test_profile_counts_opcodes_and_addresses(self):
+        memory, result = profile_intcode([1001, 8, -1, 8, 1005, 8, 0, 99, 3])
+
+        self.assertEqual(0, memory[8])
+        self.assertEqual(7, result.steps)
+        self.assertEqual({"ADDITION": 3, "JUMP_IF_TRUE": 3, "HALT": 1}, result.opcodes)
+        self.assertEqual({0: 3, 4: 3, 7: 1}, result.addresses)
+
+    def test_profile_records_branches(self):
+        _, result = profile_intcode([1001, 8, -1, 8, 1005, 8, 0, 99, 3])
+
+        self.assertEqual({4: [2, 1]}, result.branches)
+
+    def test_profile_records_memory_heatmaps(self):
+        _, result = profile_intcode([1001, 8, -1, 8, 1005, 8, 0, 99, 3])
+
+        self.assertEqual({8: 6}, result.reads)
+        self.assertEqual({8: 3}, result.writes)
+
+    def test_profile_exports_json(self):
+        _, result = profile_intcode([1001, 8, -1, 8, 1005, 8, 0, 99, 3])
+
+        exported = json.loads(result.to_json())
+
+        self.assertEqual(7, exported["steps"])
+        self.assertEqual([2, 1], exported["branches"]["4"])
+
+    def test_profile_report(self):
+        _, result = profile_intcode([1001, 8, -1, 8, 1005, 8, 0, 99, 3])
+
+        report = result.report()
+
+        self.assertIn("7 steps", report)
+        self.assertIn("JUMP_IF_TRUE", report)
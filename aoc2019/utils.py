@@ -1,3 +1,73 @@
+import unittest
+from array import array
+from io import BytesIO
+
+
 def read_file_to_list(path):
     with open(path) as fp:
         return [line.rstrip() for line in fp]
+
+
+def read_intcode(path, chunk_size=1 << 16):
+    with open(path, "rb") as fp:
+        return parse_intcode(fp, chunk_size)
+
+
+def parse_intcode(stream, chunk_size=1 << 16):
+    # parse comma separated ints from a byte stream (a file, or an mmap) one
+    # chunk at a time, keeping only the unfinished token between chunks
+    cells = array("q")
+    partial = b""
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+
+        tokens = (partial + chunk).split(b",")
+        partial = tokens.pop()
+        cells = _extend_cells(cells, map(int, tokens))
+
+    if partial.strip():
+        cells = _extend_cells(cells, [int(partial)])
+
+    return cells
+
+
+def _extend_cells(cells, values):
+    values = list(values)
+    length = len(cells)
+
+    try:
+        cells.extend(values)
+    except OverflowError:
+        # too wide for int64, so keep going with arbitrary precision ints
+        del cells[length:]
+        cells = list(cells)
+        cells.extend(values)
+
+    return cells
+
+
+class Test(unittest.TestCase):
+    def test_parse_intcode_reads_ints(self):
+        cells = parse_intcode(BytesIO(b"1,0,-3,99\n"))
+
+        self.assertEqual(array("q", [1, 0, -3, 99]), cells)
+
+    def test_parse_intcode_joins_tokens_split_across_chunks(self):
+        cells = parse_intcode(BytesIO(b"1002,4,3,4,33"), chunk_size=3)
+
+        self.assertEqual([1002, 4, 3, 4, 33], list(cells))
+
+    def test_parse_intcode_promotes_to_list_for_big_values(self):
+        cells = parse_intcode(BytesIO(b"1,%d,3" % 2 ** 70), chunk_size=4)
+
+        self.assertEqual([1, 2 ** 70, 3], cells)
+
+    def test_parse_intcode_of_empty_stream(self):
+        self.assertEqual(0, len(parse_intcode(BytesIO(b""))))
+
+    def test_parse_intcode_rejects_empty_tokens(self):
+        with self.assertRaises(ValueError):
+            parse_intcode(BytesIO(b"1,,2"))